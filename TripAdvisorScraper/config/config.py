@@ -146,9 +146,6 @@ class Config:
                     'SEARCH_BY_TERMS', 'SEARCH_BY_LOCATION'
                 ))
 
-            if self.is_true('SCRAP_GEO') and not self.is_set('GOOGLE_MAPS_API_KEY'):
-                raise Exception('You must specify a valid Google Maps API Key to scrap hotel\'s geolocation info')
-
         except Exception as e:
             raise ValueError('Configuration is not valid: {}'.format(str(e)))
 
@@ -37,14 +37,64 @@ SCRAP_REVIEWS = True
 # Activa/Desactiva el escrapeo de las geolocalizaciones de los hoteles
 SCRAP_GEO = False
 
+# La geolocalización de los hoteles se extrae de la propia página del hotel (coordenadas del mapa).
 # Indica la clave API a usar para obtener las geolocalizaciones de los hoteles
-# a partir de la información scrapeada de los hoteles (dirección fisica del hotel)
-# Esta variable solo es necesaria si SCRAP_GEO está a True
+# a partir de la información scrapeada de los hoteles (dirección fisica del hotel), cuando no
+# se encuentran las coordenadas en la página del hotel.
+# Si no se indica, los hoteles sin coordenadas en su página no se geolocalizarán.
 # GOOGLE_MAPS_API_KEY = ''
 
+# Si se especifica, las geolocalizaciones obtenidas de la API de Google Maps se almacenan en
+# una caché persistente (base de datos sqlite) cuya ruta se indica en esta variable, para no volver
+# a solicitarlas en siguientes ejecuciones del scraper.
+GEOCODE_CACHE = Path('../data/geocode_cache.db')
+
 # Activa/Desactiva el escrapeado de las deals (ofertas) de los hoteles
 SCRAP_DEALS = True
 
+# Si está activo, las páginas de los hoteles se obtienen sin usar Splash, y solo se renderizan con
+# Splash (para cargar las deals) si las deals no están en el HTML de la página.
+# En caso contrario, si SCRAP_DEALS está activo, todas las páginas de hoteles se renderizan con Splash.
+RENDER_HOTEL_PAGES_ON_DEMAND = True
+
+# Si está activo, al procesar la primera página de reviews de un hotel se generan a la vez las
+# requests de todas sus páginas de reviews (a partir del número total de reviews y el tamaño de página)
+# En caso contrario, cada página de reviews se solicita después de procesar la anterior.
+REVIEWS_PAGINATION_FAN_OUT = True
+
+# Si se indica, es el número máximo de páginas de reviews que se escrapearán por cada hotel
+MAX_REVIEW_PAGES = None
+
+# Si se indica, es el número máximo de hoteles que se escrapearán de los resultados de una búsqueda
+# por términos
+MAX_SEARCH_RESULTS = None
+
+# Si está activo, se conservan los datos de las ejecuciones anteriores (la base de datos sqlite y los
+# ficheros JSON no se vacían): Los hoteles ya almacenados se actualizan, no se vuelven a escrapear los
+# hoteles escrapeados hace menos de HOTEL_FRESHNESS_WINDOW segundos, y las reviews de cada hotel se
+# escrapean solo hasta encontrar la primera review ya almacenada (las páginas de reviews de los hoteles
+# nuevos se solicitan todas a la vez si REVIEWS_PAGINATION_FAN_OUT está activo).
+# El fichero OUTPUT_BULK_JSON solo contiene los hoteles escrapeados en esta ejecución y sus reviews nuevas;
+# la información completa se obtiene de la base de datos (ruta "/get-json-data" de la aplicación web).
+# (se necesita indicar la opción OUTPUT_SQLITE)
+INCREMENTAL_CRAWL = False
+HOTEL_FRESHNESS_WINDOW = 24 * 3600
+
+
+
+# CONFIGURACIÓN DE SPLASH
+
+# Tiempo máximo en segundos que se espera a que ocurra cada evento en el DOM de una página
+# renderizada con Splash (e.g: que aparezca un elemento antes de clickearlo)
+SPLASH_ACTION_TIMEOUT = 10
+
+# Tiempo máximo en segundos para realizar todas las acciones de una request con Splash. Si se supera,
+# se escrapea la página con el DOM que haya en ese momento.
+SPLASH_REQUEST_TIMEOUT = 30
+
+# Tiempo en segundos que se da a Splash para cargar una página, antes de realizar las acciones.
+SPLASH_PAGE_LOAD_TIMEOUT = 30
+
 
 
 
@@ -73,8 +123,24 @@ OUTPUT_HOTEL_INFO_JSON = Path('../data/tripadvisor_info.json')
 #se introducirán en el fichero que se indica en esta variable en formato JSON
 OUTPUT_GEO_JSON = Path('../data/tripadvisor_geo.json')
 
+# Tamaño en bytes del buffer de escritura de cada fichero JSON, y tiempo máximo en segundos que
+# los items pueden estar en el buffer antes de escribirse en el fichero.
+OUTPUT_JSON_BUFFER_SIZE = 1 << 20
+OUTPUT_JSON_FLUSH_INTERVAL = 5
+
+# Si se indican, los ficheros JSON se rotan cuando superan el tamaño indicado en bytes o cuando
+# han pasado los segundos indicados desde que se crearon. Los siguientes ficheros se numeran
+# (e.g: tripadvisor_reviews.1.json, tripadvisor_reviews.2.json, ...)
+# Al empezar, se borran los ficheros numerados de ejecuciones anteriores, salvo en el modo incremental
+# (ver INCREMENTAL_CRAWL), en el que se sigue escribiendo al final del último de ellos.
+OUTPUT_JSON_MAX_FILE_SIZE = None
+OUTPUT_JSON_MAX_FILE_AGE = None
+
+# Si está activo, los ficheros JSON se comprimen con gzip (se añade la extensión .gz)
+OUTPUT_JSON_GZIP = False
+
 # Si se especifica, se creado un fichero JSON donde se vuelca toda la información escrapeada
-# (se necesita indicar la opción OUTPUT_SQLITE)
+# (la información de cada hotel se escribe en cuanto se han escrapeado todos sus datos)
 OUTPUT_BULK_JSON = Path('../data/tripadvisor_bulk.json')
 
 
@@ -82,6 +148,15 @@ OUTPUT_BULK_JSON = Path('../data/tripadvisor_bulk.json')
 # ruta se indica en esta variable
 OUTPUT_SQLITE = Path('../data/tripadvisor.db')
 
+# Número máximo de items que se agrupan antes de insertarlos en la base de datos sqlite, y
+# tiempo máximo en segundos que un item puede estar pendiente de insertar.
+SQLITE_BATCH_SIZE = 500
+SQLITE_FLUSH_INTERVAL = 5
+
+# Número máximo de items que pueden estar pendientes de almacenarse en la base de datos sqlite.
+# Si se alcanza, el crawler se ralentiza hasta que se almacenen.
+SQLITE_QUEUE_SIZE = 1000
+
 
 
 
@@ -0,0 +1,191 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+from threading import Thread
+from queue import Queue, Empty
+from twisted.internet import reactor, defer
+from twisted.python.failure import Failure
+from TripAdvisorScraper.item_db import TripAdvisorDB
+from TripAdvisorScraper.config.config import GlobalConfig
+
+
+class TripAdvisorDBWriter(Thread):
+    '''
+    Almacena items en la base de datos sqlite desde un hilo dedicado, para que las escrituras
+    en disco no bloqueen el reactor de Twisted.
+
+    Los items se pasan al hilo a través de una cola acotada ("SQLITE_QUEUE_SIZE" items). El método
+    write() devuelve un Deferred que se dispara en cuanto el item está en la cola, de manera que los
+    items no esperan a que se confirme la transacción. Si la cola está llena, write() no encola el item
+    hasta que haya sitio, de manera que el crawler se ralentiza en vez de acumular items en memoria.
+    Los errores al almacenar los items se registran en el log, y los errores al confirmar las
+    transacciones se notifican también con el Deferred que devuelve close()
+
+    Todos los métodos salvo run() deben invocarse desde el hilo del reactor.
+    '''
+
+    # Mensajes de control para el hilo (_FLUSH solo se usa internamente, cuando no llegan items
+    # durante "SQLITE_FLUSH_INTERVAL" segundos)
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, db_path, reset = False):
+        '''
+        Inicializa la instancia.
+        :param db_path: Es la ruta de la base de datos sqlite.
+        :param reset: Si es True, se recrean las tablas de la base de datos al iniciar el hilo.
+        '''
+        Thread.__init__(self, name = 'TripAdvisorDBWriter', daemon = True)
+        config = GlobalConfig()
+        self.db_path = db_path
+        self.reset = reset
+        self.queue_size = max(config.get_value('SQLITE_QUEUE_SIZE', 1000), 1)
+        self.flush_interval = config.get_value('SQLITE_FLUSH_INTERVAL', 5)
+        self.queue = Queue(maxsize = self.queue_size + 1)
+        self.semaphore = defer.DeferredSemaphore(self.queue_size)
+        self.log = logging.getLogger(__name__)
+
+        # Se dispara cuando la base de datos se ha abierto (o con un error si no se pudo abrir)
+        self.opened = defer.Deferred()
+        # Se dispara cuando el hilo ha terminado
+        self.closed = defer.Deferred()
+
+
+    def open(self):
+        '''
+        Inicia el hilo.
+        :return: Devuelve un Deferred que se dispara cuando la base de datos está lista.
+        '''
+        self.start()
+        return self.opened
+
+
+    def write(self, item):
+        '''
+        Encola un item para almacenarlo en la base de datos.
+        :return: Devuelve un Deferred que se dispara con el item en cuanto este se ha encolado (no
+        espera a que se almacene). Si la cola está llena, espera a que el hilo saque algún item de ella.
+        '''
+        d = self.semaphore.acquire()
+        d.addCallback(self._enqueue, item)
+        return d
+
+    def _enqueue(self, semaphore, item):
+        self.queue.put_nowait(item)
+        return item
+
+
+    def close(self):
+        '''
+        Inserta los items pendientes, cierra la conexión con la base de datos y detiene el hilo.
+        :return: Devuelve un Deferred que se dispara cuando el hilo ha terminado, o con un error si
+        alguna transacción no pudo completarse (los items de esa transacción no se han almacenado)
+        '''
+        if self.is_alive():
+            self.queue.put(self._STOP)
+        elif not self.closed.called:
+            self.closed.callback(None)
+        return self.closed
+
+
+    def run(self):
+        try:
+            db = TripAdvisorDB(self.db_path, auto_flush = False)
+            if self.reset:
+                db.reset()
+            else:
+                db.migrate()
+        except Exception:
+            failure = Failure()
+            reactor.callFromThread(self.opened.errback, failure)
+            self._drain()
+            reactor.callFromThread(self.closed.callback, None)
+            return
+        reactor.callFromThread(self.opened.callback, None)
+
+        # Primer error al confirmar una transacción (se notifica al cerrar el hilo)
+        failure = None
+        # Número de items añadidos a la transacción en curso.
+        num_pending = 0
+        stop = False
+        while not stop:
+            try:
+                task = self.queue.get(timeout = self.flush_interval)
+            except Empty:
+                task = self._FLUSH
+
+            if task is self._STOP:
+                stop = True
+            elif not task is self._FLUSH:
+                # El item ya no ocupa sitio en la cola.
+                reactor.callFromThread(self.semaphore.release)
+                try:
+                    db.save_item(task)
+                    num_pending += 1
+                except Exception:
+                    self.log.exception('Failed to save item in the sqlite database')
+
+            if num_pending > 0 and (stop or task is self._FLUSH or db.needs_flush() or num_pending >= self.queue_size):
+                flush_failure = self._flush(db, num_pending)
+                if failure is None:
+                    failure = flush_failure
+                num_pending = 0
+
+        try:
+            db.close()
+        except Exception:
+            self.log.exception('Failed to close the sqlite database')
+        if failure is None:
+            reactor.callFromThread(self.closed.callback, None)
+        else:
+            reactor.callFromThread(self.closed.errback, failure)
+
+
+    def _flush(self, db, num_pending):
+        '''
+        Confirma la transacción en curso.
+        :param num_pending: Es el número de items de la transacción.
+        :return: Devuelve None o un objeto Failure si la transacción no pudo confirmarse.
+        '''
+        try:
+            errors = db.flush()
+        except Exception:
+            self.log.exception('Failed to commit {} items in the sqlite database'.format(num_pending))
+            return Failure()
+
+        for error in errors:
+            self.log.warning('Failed to insert item in the sqlite database ({})'.format(error))
+        return None
+
+
+    def _drain(self):
+        '''
+        Descarta todos los items encolados cuando la base de datos no está disponible, hasta recibir
+        la orden de detener el hilo.
+        '''
+        while True:
+            task = self.queue.get()
+            if task is self._STOP:
+                return
+            if not task is self._FLUSH:
+                reactor.callFromThread(self.semaphore.release)
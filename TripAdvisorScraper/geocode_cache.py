@@ -0,0 +1,93 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import sqlite3
+from re import compile
+from unicodedata import normalize, combining
+
+
+# Expresión regular para reemplazar los caracteres que no son alfanuméricos de una dirección
+non_alphanumeric_regex = compile('[^0-9a-z]+')
+
+
+def normalize_address(address):
+    '''
+    Normaliza una dirección para usarla como clave en la caché de geolocalizaciones: Se pasa a
+    minúsculas, se eliminan las tildes y los signos de puntuación y se colapsan los espacios.
+    e.g:
+    normalize_address('Calle Mayor, 5   Pamplona, España') == 'calle mayor 5 pamplona espana'
+    :param address:
+    :return:
+    '''
+    address = ''.join(char for char in normalize('NFKD', address.casefold()) if not combining(char))
+    return non_alphanumeric_regex.sub(' ', address).strip()
+
+
+class GeocodeCache:
+    '''
+    Esta clase es una caché persistente (en una base de datos sqlite) de las geolocalizaciones de
+    las direcciones de los hoteles, para no volver a hacer requests a la API de Google Maps con
+    direcciones que ya se geolocalizaron.
+    Las direcciones se normalizan antes de usarlas como clave (ver normalize_address)
+    '''
+    def __init__(self, db_path):
+        '''
+        Inicializa la instancia.
+        :param db_path: Es la ruta de la base de datos sqlite de la caché.
+        '''
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS geocode (
+                address TEXT PRIMARY KEY,
+                latitude FLOAT NOT NULL,
+                longitude FLOAT NOT NULL
+            );
+            """)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, address):
+        '''
+        Busca la geolocalización de una dirección en la caché.
+        :param address: Es la dirección (normalizada)
+        :return: Devuelve una tupla (latitud, longitud) o None si la dirección no está en la caché
+        '''
+        register = self.db.execute('SELECT latitude, longitude FROM geocode WHERE address = ?;', (address,)).fetchone()
+        if register is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return register
+
+    def put(self, address, latitude, longitude):
+        '''
+        Almacena la geolocalización de una dirección en la caché.
+        :param address: Es la dirección (normalizada)
+        '''
+        self.db.execute('INSERT OR REPLACE INTO geocode (address, latitude, longitude) VALUES (?, ?, ?);',
+                        (address, latitude, longitude))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -21,31 +21,132 @@ SOFTWARE.
 '''
 
 import sqlite3
-from os.path import dirname, join
+import json
+from time import monotonic, time
+from itertools import groupby
+from operator import itemgetter
+from os.path import dirname, join, abspath
+from urllib.request import pathname2url
 from TripAdvisorScraper.logger import Logger
 from TripAdvisorScraper.config.config import GlobalConfig
 
+'''
+Migraciones del esquema de la base de datos. La migración i-ésima actualiza el esquema de la
+versión i - 1 a la versión i. Deben poder aplicarse sobre bases de datos creadas antes de que
+existieran las migraciones (por eso se usa "IF NOT EXISTS").
+Las nuevas migraciones se añaden al final de la lista; nunca deben modificarse las existentes.
+'''
+migrations = [
+    # 1: Tablas de los items
+    """
+    CREATE TABLE IF NOT EXISTS hotel_info (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        address TEXT NOT NULL,
+        amenities TEXT,
+        phone_number TEXT
+    );
+    CREATE TABLE IF NOT EXISTS hotel_geo (
+        hotel_id TEXT PRIMARY KEY,
+        latitude FLOAT NOT NULL,
+        longitude FLOAT NOT NULL,
+        FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
+    );
+    CREATE TABLE IF NOT EXISTS hotel_review (
+        hotel_id TEXT NOT NULL,
+        review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        rating INT NOT NULL,
+        text TEXT NOT NULL,
+        date TEXT NOT NULL,
+        UNIQUE(hotel_id, review_id),
+        FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
+    );
+    CREATE TABLE IF NOT EXISTS hotel_deal (
+        hotel_id TEXT NOT NULL,
+        deal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        provider_name TEXT NOT NULL,
+        price INT NOT NULL,
+        UNIQUE(hotel_id, deal_id),
+        FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
+    );
+    """,
+
+    # 2: Índice que cubre la consulta de las deals por hotel (las reviews ya se recorren por hotel con el
+    # índice de la restricción UNIQUE(hotel_id, review_id), y la geolocalización con su clave primaria)
+    """
+    CREATE INDEX IF NOT EXISTS hotel_deal_by_hotel ON hotel_deal (hotel_id, deal_id, provider_name, price);
+    """,
+
+    # 3: Fecha (timestamp UNIX) en la que se escrapeó por última vez cada hotel (para el modo incremental)
+    """
+    ALTER TABLE hotel_info ADD COLUMN scraped_at REAL;
+    """,
+
+    # 4: Id de las reviews en TripAdvisor (las reviews escrapeadas de nuevo reemplazan a las almacenadas)
+    """
+    ALTER TABLE hotel_review ADD COLUMN tripadvisor_id INTEGER;
+    CREATE UNIQUE INDEX IF NOT EXISTS hotel_review_by_tripadvisor_id ON hotel_review (tripadvisor_id);
+    """,
+
+    # 5: Índice que cubre la búsqueda de una review sin id de TripAdvisor en el modo incremental (por
+    # hotel, fecha y título)
+    """
+    CREATE INDEX IF NOT EXISTS hotel_review_by_hotel_date ON hotel_review (hotel_id, date, title);
+    """
+]
+
+
 class TripAdvisorDB(Logger):
     '''
     Esta clase se encarga de gestionar la base de datos sqlite3 en la que se almacenan
     los items scrapeados de Trip Advisor.
+
+    Los items no se insertan en la base de datos de uno en uno: se agrupan por tabla y se insertan
+    en lotes (en una única transacción) cuando hay "SQLITE_BATCH_SIZE" items pendientes o cuando han
+    pasado "SQLITE_FLUSH_INTERVAL" segundos desde la última inserción. Los items pendientes se insertan
+    también al invocar flush() o close()
     '''
-    def __init__(self, db_path):
+    def __init__(self, db_path, auto_flush = True, read_only = False):
         '''
         Inicializa la instancia. En el constructor se abre la conexión con la base de
         datos.
+        :param auto_flush: Si es False, los items pendientes no se insertan automáticamente al
+        añadir nuevos items; debe comprobarse needs_flush() e invocarse flush() explícitamente.
+        :param read_only: Si es True, la base de datos se abre en modo de solo lectura (no se crea si no
+        existe y no se modifica su configuración). Sirve para consultar la base de datos mientras
+        se está escrapeando.
         '''
-
-        Logger.__init__(self, GlobalConfig().get_path('OUTPUT_SQLITE_LOG'))
+        config = GlobalConfig()
+        Logger.__init__(self, config.get_path('OUTPUT_SQLITE_LOG'))
+        self.debug_enabled = config.is_true('ENABLE_DEBUG')
 
         self.log.debug('Connecting to TripAdvisor sqlite database...')
-        self.db = sqlite3.connect(db_path)
+        if read_only:
+            self.db = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(abspath(db_path))), uri = True)
+        else:
+            self.db = sqlite3.connect(db_path)
+            self.db.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                PRAGMA temp_store = MEMORY;
+                PRAGMA cache_size = -65536;
+                """)
+
+        # Parámetros de las sentencias pendientes de ejecutar, indexados por la prioridad y la sentencia.
+        self.pending_items = {}
+        self.num_pending_items = 0
+        self.batch_size = config.get_value('SQLITE_BATCH_SIZE', 500)
+        self.flush_interval = config.get_value('SQLITE_FLUSH_INTERVAL', 5)
+        self.last_flush = monotonic()
+        self.auto_flush = auto_flush
 
         self.item_handlers = {
-            'TripAdvisorHotelReview': lambda item:self.insert_item(item, 'hotel_review'),
-            'TripAdvisorHotelInfo': lambda item:self.insert_item(item, 'hotel_info'),
+            'TripAdvisorHotelReview': lambda item:self.insert_item(item, 'hotel_review', replace = not item.get('tripadvisor_id') is None),
+            'TripAdvisorHotelInfo': self.insert_hotel_info,
             'TripAdvisorHotelDeals': lambda item:self.insert_item(item, 'hotel_deal'),
-            'TripAdvisorHotelGeolocation': lambda item:self.insert_item(item, 'hotel_geo')
+            'TripAdvisorHotelGeolocation': lambda item:self.insert_item(item, 'hotel_geo', replace = True)
             }
 
     def __getattr__(self, item):
@@ -53,11 +154,18 @@ class TripAdvisorDB(Logger):
 
 
     def execute(self, query, params):
-        self.log.debug('Executing SQL:\n{}\nWith this params: {}\n'.format(query, ', '.join(["'{}:{}'".format(type(param).__name__, str(param)) for param in params])))
+        if self.debug_enabled:
+            self.log.debug('Executing SQL:\n{}\nWith this params: {}\n'.format(query, ', '.join(["'{}:{}'".format(type(param).__name__, str(param)) for param in params])))
         self.db.execute(query, params)
 
+    def executemany(self, query, params):
+        if self.debug_enabled:
+            self.log.debug('Executing SQL:\n{}\nWith {} sets of params\n'.format(query, len(params)))
+        self.db.executemany(query, params)
+
     def executescript(self, sql_script, *args, **kwargs):
-        self.log.debug('Executing SQL:\n{}\n'.format(sql_script))
+        if self.debug_enabled:
+            self.log.debug('Executing SQL:\n{}\n'.format(sql_script))
         self.db.executescript(sql_script, *args, **kwargs)
 
     def _drop_tables(self):
@@ -75,46 +183,31 @@ class TripAdvisorDB(Logger):
         )
         self.commit()
 
-    def _create_tables(self):
+    def get_schema_version(self):
         '''
-        Crea todas las tablas para almacenar los items en la base de datos.
+        Devuelve la versión del esquema de la base de datos (el número de migraciones aplicadas)
         :return:
         '''
-        self.executescript(
-            """
-            CREATE TABLE hotel_info (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                address TEXT NOT NULL,
-                amenities TEXT,
-                phone_number TEXT
-            );
-            CREATE TABLE hotel_geo (
-                hotel_id TEXT PRIMARY KEY,
-                latitude FLOAT NOT NULL,
-                longitude FLOAT NOT NULL,
-                FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
-            );
-            CREATE TABLE hotel_review (
-                hotel_id TEXT NOT NULL,
-                review_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                rating INT NOT NULL,
-                text TEXT NOT NULL,
-                date TEXT NOT NULL,
-                UNIQUE(hotel_id, review_id),
-                FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
-            );
-            CREATE TABLE hotel_deal (
-                hotel_id TEXT NOT NULL,
-                deal_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                provider_name TEXT NOT NULL,
-                price INT NOT NULL,
-                UNIQUE(hotel_id, deal_id),
-                FOREIGN KEY (hotel_id) REFERENCES hotel_info(id)
-            );
-            """)
-        self.commit()
+        version, = self.db.execute('PRAGMA user_version;').fetchone()
+        return version
+
+    def migrate(self):
+        '''
+        Aplica las migraciones del esquema de la base de datos que aún no se han aplicado (ver
+        la variable "migrations"). La versión del esquema se almacena en "PRAGMA user_version".
+        Solo debe invocarse desde el proceso que escribe en la base de datos (ver TripAdvisorDBWriter)
+        :return:
+        '''
+        version = self.get_schema_version()
+        for next_version, migration in enumerate(migrations[version:], version + 1):
+            self.log.debug('Migrating sqlite database schema to version {}'.format(next_version))
+            self.executescript(
+                '''
+                BEGIN;
+                {}
+                PRAGMA user_version = {};
+                COMMIT;
+                '''.format(migration, next_version))
 
     def __enter__(self):
         return self
@@ -125,9 +218,10 @@ class TripAdvisorDB(Logger):
 
     def close(self):
         '''
-        Este método cierra la conexión con la base de datos.
+        Este método cierra la conexión con la base de datos. Antes se insertan los items pendientes.
         :return:
         '''
+        self.flush()
         self.log.debug('Shutting down sqlite connection database...')
         self.db.close()
 
@@ -138,18 +232,102 @@ class TripAdvisorDB(Logger):
         :return:
         '''
         self._drop_tables()
-        self._create_tables()
-
-    def insert_item(self, item, table_name):
-        field_names = [field_name for field_name in item.fields.keys() if not item.get(field_name) is None]
-        field_values = [item.get(field_name) for field_name in field_names]
-        self.execute(
-            'INSERT INTO {} ({}) VALUES ({});'.format(
-                table_name,
-                ', '.join(['"{}"'.format(field_name) for field_name in field_names]),
-                ', '.join(['?'] * len(field_names))),
-            field_values)
+        self.executescript('PRAGMA user_version = 0;')
+        self.migrate()
+
+    def insert_item(self, item, table_name, replace = False, extra_values = None):
+        '''
+        Añade un item a los items pendientes de insertar en la tabla indicada. Si es necesario, se
+        insertan todos los items pendientes.
+        :param replace: Si es True, el item reemplaza al registro con su misma clave (si existe)
+        :param extra_values: Es un diccionario opcional con valores de columnas de la tabla que no
+        son campos del item.
+        '''
+        values = dict((field_name, item.get(field_name)) for field_name in item.fields.keys() if not item.get(field_name) is None)
+        if not extra_values is None:
+            values.update(extra_values)
+        field_names = tuple(values.keys())
+
+        query = '{} INTO {} ({}) VALUES ({});'.format(
+            'INSERT OR REPLACE' if replace else 'INSERT',
+            table_name,
+            ', '.join(['"{}"'.format(field_name) for field_name in field_names]),
+            ', '.join(['?'] * len(field_names)))
+        self.add_pending_statement(query, tuple(values.values()))
+
+    def insert_hotel_info(self, item):
+        '''
+        Añade un item con la información de un hotel a los items pendientes de insertar. Si el hotel ya
+        estaba en la base de datos (se escrapeó en una ejecución anterior), se actualiza su información y
+        se eliminan sus deals anteriores.
+        '''
+        self.add_pending_statement('DELETE FROM hotel_deal WHERE hotel_id = ?;', (item.get('id'),), priority = 0)
+        self.insert_item(item, 'hotel_info', replace = True, extra_values = {'scraped_at' : time()})
+
+    def add_pending_statement(self, query, params, priority = 1):
+        '''
+        Añade una sentencia a las sentencias pendientes de ejecutar. Las sentencias con menor prioridad
+        se ejecutan antes (e.g: los borrados se ejecutan antes que las inserciones de un mismo lote)
+        '''
+        self.pending_items.setdefault((priority, query), []).append(params)
+        self.num_pending_items += 1
+
+        if self.auto_flush and self.needs_flush():
+            self.flush()
+
+    def needs_flush(self):
+        '''
+        Devuelve True si hay "SQLITE_BATCH_SIZE" items pendientes de insertar o si han pasado
+        "SQLITE_FLUSH_INTERVAL" segundos desde la última inserción.
+        '''
+        return self.num_pending_items > 0 and \
+               (self.num_pending_items >= self.batch_size or monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush(self):
+        '''
+        Inserta todos los items pendientes en la base de datos en una única transacción.
+        Si la inserción de un lote falla (e.g: un item repetido), los items del lote se insertan uno
+        a uno y se descartan los que no pueden insertarse.
+        :return: Devuelve una lista con los errores de los items que no han podido insertarse.
+        '''
+        self.last_flush = monotonic()
+        errors = []
+        if self.num_pending_items == 0:
+            return errors
+
+        pending_items = self.pending_items
+        self.pending_items = {}
+        self.num_pending_items = 0
+
+        # Todos los lotes se ejecutan en una única transacción. Los savepoints solo sirven para deshacer
+        # un lote que falla (fuera de una transacción, liberar un savepoint equivale a hacer commit)
+        if not self.db.in_transaction:
+            self.db.execute('BEGIN;')
+        try:
+            errors = self._execute_batches(pending_items)
+        except Exception:
+            self.db.rollback()
+            raise
         self.commit()
+        return errors
+
+    def _execute_batches(self, pending_items):
+        errors = []
+        for (priority, query), values in sorted(pending_items.items(), key = lambda entry: entry[0][0]):
+            self.db.execute('SAVEPOINT batch;')
+            try:
+                self.executemany(query, values)
+                self.db.execute('RELEASE SAVEPOINT batch;')
+            except sqlite3.Error:
+                self.db.execute('ROLLBACK TO SAVEPOINT batch;')
+                self.db.execute('RELEASE SAVEPOINT batch;')
+                for field_values in values:
+                    try:
+                        self.execute(query, field_values)
+                    except sqlite3.Error as e:
+                        self.log.warning('Failed to execute "{}": {}'.format(query, str(e)))
+                        errors.append('"{}": {}'.format(query, str(e)))
+        return errors
 
 
     def save_item(self, item):
@@ -163,65 +341,136 @@ class TripAdvisorDB(Logger):
             handler(item)
 
 
+    def get_hotel_scraped_at(self, hotel_id):
+        '''
+        Devuelve la fecha (timestamp UNIX) en la que se escrapeó por última vez el hotel indicado, o
+        None si el hotel no está en la base de datos.
+        :param hotel_id:
+        :return:
+        '''
+        register = self.db.execute('SELECT scraped_at FROM hotel_info WHERE id = ?;', (hotel_id,)).fetchone()
+        return register[0] if not register is None else None
+
+    def hotel_exists(self, hotel_id):
+        '''
+        Comprueba si un hotel ya está almacenado en la base de datos.
+        :param hotel_id:
+        :return:
+        '''
+        register = self.db.execute('SELECT 1 FROM hotel_info WHERE id = ?;', (hotel_id,)).fetchone()
+        return not register is None
+
+    def review_exists(self, hotel_id, title, date, tripadvisor_id = None):
+        '''
+        Comprueba si una review de un hotel ya está almacenada en la base de datos.
+        :param hotel_id: Es la id del hotel
+        :param title: Es el título de la review
+        :param date: Es la fecha de la review
+        :param tripadvisor_id: Es la id de la review en TripAdvisor. Si se indica, la review se busca
+        solo por su id.
+        :return:
+        '''
+        if not tripadvisor_id is None:
+            register = self.db.execute('SELECT 1 FROM hotel_review WHERE tripadvisor_id = ?;', (tripadvisor_id,)).fetchone()
+        else:
+            register = self.db.execute('SELECT 1 FROM hotel_review WHERE hotel_id = ? AND date = ? AND title = ? LIMIT 1;',
+                                       (hotel_id, date, title)).fetchone()
+        return not register is None
+
     def get_everything(self):
+        '''
+        Devuelve una lista con la información de todos los hoteles (ver iter_everything)
+        Es preferible usar iter_everything() o iter_everything_json() para no cargar todos los
+        datos en memoria.
+        :return:
+        '''
+        return list(self.iter_everything())
+
+
+    def iter_everything(self):
+        '''
+        Es un generador que devuelve la información de cada hotel de la base de datos, con
+        la siguiente estructura:
+        {
+            'info' : {
+                'name' : ..., 'phone_number' : ..., 'amenities' : ..., 'address' : ...,
+                'geo' : { 'latitude' : ..., 'longitude' : ... }
+            },
+            'reviews' : [ { 'title' : ..., 'rating' : ..., 'text' : ..., 'date' : ... }, ... ],
+            'deals' : [ { 'provider_name' : ..., 'price' : ... }, ... ]
+        }
+
+        Se ejecutan solo tres consultas (hoteles junto con su geolocalización, reviews y deals),
+        ordenadas por el id del hotel, y se recorren a la vez agrupando los registros de cada hotel.
+        Solo se mantiene en memoria la información de un hotel.
+        '''
+        def fetch_groups(query, attrs):
+            '''
+            Devuelve un iterador de tuplas (hotel_id, registros) con los registros de la consulta
+            agrupados por el id del hotel.
+            '''
+            cursor = self.cursor()
+            cursor.execute(query.format(', '.join(attrs)))
+            return ((hotel_id, [dict(zip(attrs, register[1:])) for register in registers])
+                    for hotel_id, registers in groupby(cursor, key = itemgetter(0)))
+
+        def get_group(groups, pending, hotel_id):
+            '''
+            Avanza el iterador de grupos hasta el grupo del hotel indicado y devuelve sus registros
+            (o una lista vacía si el hotel no tiene registros)
+            '''
+            while not pending[0] is None and pending[0][0] < hotel_id:
+                pending[0] = next(groups, None)
+            if not pending[0] is None and pending[0][0] == hotel_id:
+                return pending[0][1]
+            return []
+
+        reviews = fetch_groups(query = 'SELECT hotel_id, {} FROM hotel_review ORDER BY hotel_id, review_id;',
+                               attrs = ['title', 'rating', 'text', 'date'])
+        deals = fetch_groups(query = 'SELECT hotel_id, {} FROM hotel_deal ORDER BY hotel_id, deal_id;',
+                             attrs = ['provider_name', 'price'])
+        pending_reviews, pending_deals = [next(reviews, None)], [next(deals, None)]
+
         cursor = self.cursor()
-        def fetch_all(query, attrs, params = None):
-            query = query.format(', '.join(attrs))
-            if not params is None:
-                cursor.execute(query, tuple(params))
-            else:
-                cursor.execute(query)
-
-            data = []
-            for register in cursor.fetchall():
-                data.append(dict(zip(attrs, register)))
-            return data
-
-        def fetch_one(query, attrs, params = None):
-            registers = fetch_all(query, attrs, params)
-            return registers[0]
-
-
-
-        def get_hotel_info(hotel_id):
-            return fetch_one(query = 'SELECT {} FROM hotel_info WHERE id = ?;',
-                             attrs = ['name', 'phone_number', 'amenities', 'address'],
-                             params = [hotel_id])
-
-
-        def get_hotel_reviews(hotel_id):
-            return fetch_all(query = 'SELECT {} FROM hotel_review WHERE hotel_id = ?;',
-                             attrs = ['title', 'rating', 'text', 'date'],
-                             params = [hotel_id])
-
-        def get_hotel_deals(hotel_id):
-            return fetch_all(query = 'SELECT {} FROM hotel_deal WHERE hotel_id = ?;',
-                             attrs = ['provider_name', 'price'],
-                             params = [hotel_id])
-
-        def get_hotel_geo(hotel_id):
-            return fetch_one(query = 'SELECT {} FROM hotel_geo WHERE hotel_id = ?;',
-                             attrs = ['latitude', 'longitude'],
-                             params = [hotel_id])
-
-        def get_hotel_ids():
-            registers = fetch_all(query = 'SELECT {} FROM hotel_info;', attrs = ['id'])
-            hotel_ids = [register['id'] for register in registers]
-            return hotel_ids
-
-        data = []
-        hotel_ids = get_hotel_ids()
-        for hotel_id in hotel_ids:
-            hotel_info = get_hotel_info(hotel_id)
-            hotel_deals = get_hotel_deals(hotel_id)
-            hotel_reviews = get_hotel_reviews(hotel_id)
-            self.log.debug('Num reviews: {}'.format(len(hotel_reviews)))
-
-            hotel_data = {
+        cursor.execute(
+            '''
+            SELECT hotel_info.id, name, phone_number, amenities, address, latitude, longitude
+            FROM hotel_info LEFT JOIN hotel_geo ON hotel_geo.hotel_id = hotel_info.id
+            ORDER BY hotel_info.id;
+            ''')
+        for hotel_id, name, phone_number, amenities, address, latitude, longitude in cursor:
+            hotel_info = {
+                'name' : name,
+                'phone_number' : phone_number,
+                'amenities' : amenities,
+                'address' : address,
+                'geo' : {
+                    'latitude' : latitude,
+                    'longitude' : longitude
+                } if not latitude is None else None
+            }
+            yield {
                 'info' : hotel_info,
-                'reviews' : hotel_reviews,
-                'deals' : hotel_deals
+                'reviews' : get_group(reviews, pending_reviews, hotel_id),
+                'deals' : get_group(deals, pending_deals, hotel_id)
             }
-            hotel_data['info']['geo'] = get_hotel_geo(hotel_id)
-            data.append(hotel_data)
-        return data
\ No newline at end of file
+
+
+    def iter_everything_json(self):
+        '''
+        Es un generador que devuelve, por fragmentos, una lista JSON con la información de todos los
+        hoteles (ver iter_everything). Sirve para escribir los datos en un fichero o en una respuesta
+        HTTP sin construir el documento JSON entero en memoria.
+        Las consultas se ejecutan antes de devolver el primer fragmento, de manera que si fallan
+        (e.g: las tablas no existen), no se llega a devolver ningún fragmento.
+        '''
+        hotels = self.iter_everything()
+        hotel_data = next(hotels, None)
+        if hotel_data is None:
+            yield '[]'
+            return
+
+        yield '[' + json.dumps(hotel_data)
+        for hotel_data in hotels:
+            yield ', ' + json.dumps(hotel_data)
+        yield ']'
@@ -73,6 +73,8 @@ class TripAdvisorHotelInfo(Item):
 
 
 class TripAdvisorHotelReview(Item):
+    # Es la id de la review en TripAdvisor
+    tripadvisor_id = Field(input_processor = ToInt(), output_processor = TakeFirst(), mandatory = False)
     title = Field(output_processor = TakeFirst(), mandatory = True)
     rating = Field(input_processor = ToInt(), output_processor = TakeFirst(), mandatory = True)
     text = Field(output_processor = TakeFirst(), mandatory = True)
@@ -85,6 +87,14 @@ class TripAdvisorHotelDeals(Item):
     price = Field(input_processor = ToFloat(), output_processor = TakeFirst(), mandatory = True)
 
 
+class TripAdvisorHotelCompleted(Item):
+    '''
+    No contiene datos escrapeados: Indica que ya se han escrapeado todos los datos de un hotel
+    (información, deals, geolocalización y todas sus páginas de reviews)
+    '''
+    hotel_id = Field(output_processor = TakeFirst(), mandatory = True)
+
+
 class TripAdvisorHotelGeolocation(Item):
     hotel_id = Field(output_processor = TakeFirst(), mandatory = True)
     longitude = Field(input_processor = ToFloat(), output_processor = TakeFirst(), mandatory = True)
@@ -5,7 +5,11 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from scrapy import signals, Request
+from scrapy.exceptions import IgnoreRequest, DontCloseSpider
+from twisted.internet import reactor
+from collections import deque
+from time import monotonic
 
 
 class TripadvisorscraperSpiderMiddleware(object):
@@ -54,3 +58,417 @@ class TripadvisorscraperSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+
+class SplashBackend:
+    '''
+    Representa una instancia de Splash del pool de instancias (ver SplashBackendPool).
+    Lleva la cuenta de las requests pendientes, la latencia media y los errores de la instancia.
+    '''
+    def __init__(self, url):
+        '''
+        Inicializa la instancia.
+        :param url: Es la url de la instancia de Splash e.g: "http://localhost:8050/"
+        '''
+        self.url = url if url.endswith('/') else url + '/'
+        self.outstanding = 0
+        self.latency = None
+        self.num_requests = 0
+        self.num_errors = 0
+        self.consecutive_errors = 0
+        self.ejected_until = None
+
+    def is_healthy(self, now):
+        return self.ejected_until is None or self.ejected_until <= now
+
+    def __str__(self):
+        return self.url
+
+
+class SplashBackendPool:
+    '''
+    Esta clase gestiona un pool de instancias de Splash. Las requests se reparten entre las instancias
+    enviando cada una a la instancia con menos requests pendientes (a igualdad, la de menor latencia)
+    Si una instancia falla varias veces seguidas, se expulsa del pool durante un tiempo.
+
+    e.g:
+    pool = SplashBackendPool(['http://splash1:8050/', 'http://splash2:8050/'])
+    backend = pool.acquire()
+    ...
+    pool.release(backend, latency = 1.2, error = False)
+    '''
+    def __init__(self, urls, max_consecutive_errors = 3, eject_time = 30, latency_smoothing = 0.3, clock = monotonic):
+        '''
+        Inicializa la instancia.
+        :param urls: Es un listado con las urls de las instancias de Splash
+        :param max_consecutive_errors: Es el número de errores consecutivos tras el cual una instancia
+        se expulsa del pool.
+        :param eject_time: Es el tiempo en segundos durante el que una instancia queda expulsada.
+        :param latency_smoothing: Es el peso de cada nueva medida en la media móvil de la latencia.
+        :param clock: Es la función usada para obtener el tiempo actual.
+        '''
+        if len(urls) == 0:
+            raise ValueError('At least one Splash instance must be specified')
+        self.backends = [SplashBackend(url) for url in urls]
+        self.max_consecutive_errors = max_consecutive_errors
+        self.eject_time = eject_time
+        self.latency_smoothing = latency_smoothing
+        self.clock = clock
+
+    def get_backend(self, url):
+        for backend in self.backends:
+            if backend.url == url:
+                return backend
+        return None
+
+    def acquire(self, exclude = []):
+        '''
+        Selecciona la instancia a la que se enviará una request y aumenta su número de requests pendientes.
+        :param exclude: Es un listado de urls de instancias que no deben seleccionarse si hay otras
+        disponibles (e.g: la instancia que ha fallado al reintentar una request)
+        :return: Devuelve la instancia seleccionada (un objeto de la clase SplashBackend)
+        '''
+        now = self.clock()
+        candidates = [backend for backend in self.backends if backend.is_healthy(now) and not backend.url in exclude]
+        if len(candidates) == 0:
+            candidates = [backend for backend in self.backends if not backend.url in exclude]
+        if len(candidates) == 0:
+            candidates = self.backends
+
+        backend = min(candidates, key = lambda backend: (backend.outstanding,
+                                                          backend.latency if not backend.latency is None else 0))
+        backend.outstanding += 1
+        return backend
+
+    def release(self, backend, latency = None, error = False):
+        '''
+        Debe invocarse cuando una request enviada a una instancia finaliza.
+        :param backend: Es la instancia.
+        :param latency: Es el tiempo en segundos que tardó la request.
+        :param error: Indica si la request falló.
+        '''
+        backend.outstanding = max(backend.outstanding - 1, 0)
+        backend.num_requests += 1
+        if not latency is None:
+            backend.latency = latency if backend.latency is None else\
+                (1 - self.latency_smoothing) * backend.latency + self.latency_smoothing * latency
+
+        if error:
+            backend.num_errors += 1
+            backend.consecutive_errors += 1
+            if backend.consecutive_errors >= self.max_consecutive_errors:
+                backend.ejected_until = self.clock() + self.eject_time
+                backend.consecutive_errors = 0
+        else:
+            backend.consecutive_errors = 0
+            backend.ejected_until = None
+
+    def cancel(self, backend):
+        '''
+        Debe invocarse cuando una request asignada a una instancia finaliza sin llegar a enviarse a la
+        instancia (e.g: la respuesta se ha servido desde la caché de páginas). No cuenta para la latencia
+        ni para los errores de la instancia.
+        :param backend: Es la instancia.
+        '''
+        backend.outstanding = max(backend.outstanding - 1, 0)
+
+
+class SplashPoolMiddleware:
+    '''
+    Es un downloader middleware que reparte las requests de Splash (SplashRequest) entre varias instancias
+    de Splash (ver SplashBackendPool). Debe tener menor prioridad que scrapy_splash.SplashMiddleware.
+
+    Las instancias se configuran con la variable "SPLASH_URLS" (por defecto, solo "SPLASH_URL")
+    Si una request falla (excepción o código de respuesta en "SPLASH_POOL_RETRY_HTTP_CODES"), se reintenta
+    en otra instancia como mucho "SPLASH_POOL_MAX_RETRIES" veces.
+    Una instancia se expulsa del pool "SPLASH_POOL_EJECT_TIME" segundos tras fallar
+    "SPLASH_POOL_MAX_CONSECUTIVE_ERRORS" veces seguidas.
+    '''
+    def __init__(self, pool, max_retries = 2, retry_http_codes = [502, 503, 504], stats = None):
+        self.pool = pool
+        self.max_retries = max_retries
+        self.retry_http_codes = set(retry_http_codes)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        urls = settings.getlist('SPLASH_URLS') or [settings.get('SPLASH_URL', 'http://127.0.0.1:8050/')]
+        pool = SplashBackendPool(urls,
+                                 max_consecutive_errors = settings.getint('SPLASH_POOL_MAX_CONSECUTIVE_ERRORS', 3),
+                                 eject_time = settings.getfloat('SPLASH_POOL_EJECT_TIME', 30))
+        return cls(pool,
+                   max_retries = settings.getint('SPLASH_POOL_MAX_RETRIES', 2),
+                   retry_http_codes = [int(code) for code in settings.getlist('SPLASH_POOL_RETRY_HTTP_CODES', [502, 503, 504])],
+                   stats = crawler.stats)
+
+    def inc_stats(self, backend, key, value = 1):
+        if not self.stats is None:
+            self.stats.inc_value('splash_pool/{}/{}'.format(backend.url, key), value)
+
+    def process_request(self, request, spider):
+        if not 'splash' in request.meta:
+            return None
+
+        if not request.meta.get('_splash_processed'):
+            # La request aún no ha sido procesada por SplashMiddleware: Seleccionamos la instancia.
+            backend = self.pool.acquire()
+            request.meta['splash']['splash_url'] = backend.url
+            request.meta['splash_backend'] = backend.url
+        elif 'splash_backend' in request.meta:
+            # La request se va a descargar.
+            request.meta['splash_backend_start'] = monotonic()
+        return None
+
+    def _finish(self, request, error):
+        backend = self.pool.get_backend(request.meta['splash_backend'])
+        start = request.meta.get('splash_backend_start')
+        latency = monotonic() - start if not start is None else None
+        self.pool.release(backend, latency, error)
+        self.inc_stats(backend, 'errors' if error else 'responses')
+        return backend
+
+    def _cancel(self, request):
+        self.pool.cancel(self.pool.get_backend(request.meta['splash_backend']))
+
+    def _retry(self, request, backend, spider):
+        retries = request.meta.get('splash_pool_retries', 0)
+        if retries >= self.max_retries:
+            return None
+
+        next_backend = self.pool.acquire(exclude = [backend.url])
+        spider.logger.debug('Retrying {} on Splash instance {} (failed on {})'.format(request, next_backend, backend))
+        self.inc_stats(next_backend, 'retries')
+
+        retry_request = request.replace(url = next_backend.url + request.url[len(backend.url):], dont_filter = True)
+        retry_request.meta['splash']['splash_url'] = next_backend.url
+        retry_request.meta['splash_backend'] = next_backend.url
+        retry_request.meta['splash_pool_retries'] = retries + 1
+        return retry_request
+
+    def process_response(self, request, response, spider):
+        if not (request.meta.get('_splash_processed') and 'splash_backend' in request.meta):
+            return response
+
+        if 'cached' in response.flags:
+            # La respuesta viene de la caché de páginas: la instancia no ha llegado a procesar la request.
+            self._cancel(request)
+            return response
+
+        error = response.status in self.retry_http_codes
+        backend = self._finish(request, error)
+        if error:
+            retry_request = self._retry(request, backend, spider)
+            if not retry_request is None:
+                return retry_request
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not (request.meta.get('_splash_processed') and 'splash_backend' in request.meta):
+            return None
+        if isinstance(exception, IgnoreRequest):
+            self._cancel(request)
+            return None
+
+        backend = self._finish(request, True)
+        return self._retry(request, backend, spider)
+
+
+
+class GeocodeLane:
+    '''
+    Es un carril de requests dedicado a las requests de geolocalización (GMapRequests). Las requests
+    se encolan y se envían al motor de Scrapy respetando un límite de velocidad (token bucket) y un
+    número máximo de requests simultáneas, de forma que no compiten con las requests a TripAdvisor
+    ni superan el límite de la API de Google Maps.
+    Las requests que fallan se reintentan tras un tiempo de espera que crece exponencialmente.
+
+    Hay un único carril por crawler (ver GeocodeLane.from_crawler)
+    Se configura con las variables "GEOCODE_RATE_LIMIT" (requests por segundo, 0 para no limitarla), "GEOCODE_BURST",
+    "GEOCODE_MAX_IN_FLIGHT", "GEOCODE_MAX_RETRIES" y "GEOCODE_RETRY_BACKOFF" (segundos)
+    '''
+    def __init__(self, crawler, rate = 10, burst = 10, max_in_flight = 4, max_retries = 3, backoff = 1,
+                 clock = monotonic):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        # Si el límite de velocidad es 0, no se limita la velocidad (solo el número de requests simultáneas)
+        self.rate = max(float(rate), 0)
+        self.burst = float(burst)
+        self.max_in_flight = max_in_flight
+        if self.rate > 0 and self.burst < 1:
+            raise ValueError('Geocode lane burst must be at least 1 (got {})'.format(burst))
+        if self.max_in_flight < 1:
+            raise ValueError('Geocode lane max in flight requests must be at least 1 (got {})'.format(max_in_flight))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.clock = clock
+
+        self.tokens = self.burst
+        self.last_refill = clock()
+        self.queue = deque()
+        self.in_flight = 0
+        self.num_delayed = 0
+        self.dispatch_call = None
+
+        crawler.signals.connect(self.spider_idle, signal = signals.spider_idle)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if getattr(crawler, 'geocode_lane', None) is None:
+            settings = crawler.settings
+            crawler.geocode_lane = cls(crawler,
+                                       rate = settings.getfloat('GEOCODE_RATE_LIMIT', 10),
+                                       burst = settings.getfloat('GEOCODE_BURST', 10),
+                                       max_in_flight = settings.getint('GEOCODE_MAX_IN_FLIGHT', 4),
+                                       max_retries = settings.getint('GEOCODE_MAX_RETRIES', 3),
+                                       backoff = settings.getfloat('GEOCODE_RETRY_BACKOFF', 1))
+        return crawler.geocode_lane
+
+    def is_empty(self):
+        return len(self.queue) == 0 and self.in_flight == 0 and self.num_delayed == 0
+
+    def spider_idle(self, spider):
+        # La araña no debe cerrarse mientras queden requests en el carril.
+        if not self.is_empty():
+            raise DontCloseSpider()
+
+    def enqueue(self, request, spider):
+        '''
+        Añade una request a la cola del carril.
+        '''
+        self.queue.append((request, self.clock()))
+        self.dispatch(spider)
+
+    def enqueue_later(self, request, spider, delay):
+        self.num_delayed += 1
+        def enqueue():
+            self.num_delayed -= 1
+            self.enqueue(request, spider)
+        reactor.callLater(delay, enqueue)
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def dispatch(self, spider):
+        '''
+        Envía al motor de Scrapy tantas requests de la cola como permitan el límite de velocidad y
+        el número máximo de requests simultáneas.
+        '''
+        self.refill()
+        while len(self.queue) > 0 and self.in_flight < self.max_in_flight and (self.rate == 0 or self.tokens >= 1):
+            request, enqueued = self.queue.popleft()
+            if self.rate > 0:
+                self.tokens -= 1
+            self.in_flight += 1
+
+            wait_time = self.clock() - enqueued
+            self.stats.inc_value('geocode_lane/queue_wait_time', wait_time)
+            self.stats.max_value('geocode_lane/max_queue_wait_time', wait_time)
+            self.stats.inc_value('geocode_lane/dispatched')
+
+            request.meta['geocode_lane_dispatched'] = True
+            self.crawler.engine.crawl(request, spider)
+
+        # Si quedan requests y no hay tokens, se vuelve a intentar cuando haya uno disponible.
+        if len(self.queue) > 0 and self.in_flight < self.max_in_flight and self.rate > 0 and\
+                (self.dispatch_call is None or not self.dispatch_call.active()):
+            self.dispatch_call = reactor.callLater((1 - self.tokens) / self.rate, self.dispatch, spider)
+
+    def release(self, request, spider):
+        '''
+        Debe invocarse cuando una request del carril finaliza, sea cual sea el motivo (respuesta,
+        error o request descartada). Cada request solo se libera una vez.
+        '''
+        if not request.meta.get('geocode_lane_dispatched') or request.meta.get('geocode_lane_released'):
+            return
+        request.meta['geocode_lane_released'] = True
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.dispatch(spider)
+
+    def retry(self, request, spider, reason):
+        '''
+        Vuelve a encolar una request del carril que ha fallado, tras un tiempo de espera.
+        :return: Devuelve False si la request ha superado el número máximo de reintentos.
+        '''
+        retries = request.meta.get('geocode_lane_retries', 0)
+        if retries >= self.max_retries:
+            self.stats.inc_value('geocode_lane/retries_exhausted')
+            return False
+
+        delay = self.backoff * (2 ** retries)
+        spider.logger.debug('Retrying {} in {} seconds: {}'.format(request, delay, reason))
+        self.stats.inc_value('geocode_lane/retries')
+
+        retry_request = request.replace(dont_filter = True)
+        retry_request.meta['geocode_lane_retries'] = retries + 1
+        del retry_request.meta['geocode_lane_dispatched']
+        retry_request.meta.pop('geocode_lane_released', None)
+        request.meta['geocode_lane_retried'] = True
+        self.enqueue_later(retry_request, spider, delay)
+        return True
+
+
+class GeocodeLaneSpiderMiddleware:
+    '''
+    Es un spider middleware que desvía las requests de geolocalización (requests con el metadato
+    "geocode_lane") generadas por la araña al carril de geolocalización (ver GeocodeLane)
+    '''
+    def __init__(self, lane):
+        self.lane = lane
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(GeocodeLane.from_crawler(crawler))
+
+    def process_spider_output(self, response, result, spider):
+        for entry in result:
+            if isinstance(entry, Request) and entry.meta.get('geocode_lane') and\
+                    not entry.meta.get('geocode_lane_dispatched'):
+                self.lane.enqueue(entry, spider)
+            else:
+                yield entry
+
+
+class GeocodeLaneDownloaderMiddleware:
+    '''
+    Es un downloader middleware que libera las requests del carril de geolocalización cuando finalizan
+    y reintenta las que fallan (errores HTTP o límite de la API superado) a través del carril.
+    '''
+    retry_http_codes = set([429, 500, 502, 503, 504])
+
+    def __init__(self, lane):
+        self.lane = lane
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(GeocodeLane.from_crawler(crawler))
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get('geocode_lane_dispatched'):
+            return response
+        self.lane.release(request, spider)
+
+        if response.status in self.retry_http_codes:
+            reason = 'HTTP status {}'.format(response.status)
+        elif b'OVER_QUERY_LIMIT' in response.body:
+            reason = 'OVER_QUERY_LIMIT'
+        else:
+            return response
+
+        if self.lane.retry(request, spider, reason):
+            raise IgnoreRequest(reason)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not request.meta.get('geocode_lane_dispatched'):
+            return None
+        self.lane.release(request, spider)
+        # Las requests descartadas (e.g: por otro middleware) no se reintentan.
+        if isinstance(exception, IgnoreRequest):
+            return None
+        if self.lane.retry(request, spider, str(exception)):
+            raise IgnoreRequest(str(exception))
+        return None
@@ -0,0 +1,214 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import gzip
+import json
+from io import BufferedWriter
+from time import monotonic
+from os.path import splitext, exists, getsize
+from os import remove
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+def serialize(data):
+    '''
+    Serializa un objeto a JSON (codificado en UTF-8). Si está instalada la librería orjson, se usa
+    esta (es bastante más rápida que el módulo json). En caso contrario, o si orjson no puede
+    serializar el objeto, se usa el módulo json.
+    :param data:
+    :return:
+    '''
+    if not orjson is None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data).encode('utf-8')
+
+
+
+class NDJSONWriter:
+    '''
+    Escribe objetos en un fichero en formato NDJSON (un objeto JSON por línea).
+    El fichero se mantiene abierto mientras se escribe, y las escrituras se almacenan en un buffer
+    que se vuelca a disco cuando se llena o cuando han pasado "flush_interval" segundos desde el último
+    volcado.
+
+    Si se indica "max_size" o "max_age", el fichero se rota cuando se han escrito más de "max_size"
+    bytes (sin comprimir) o cuando han pasado más de "max_age" segundos desde que se abrió:
+    El primer fichero tiene la ruta indicada y los siguientes se numeran, e.g:
+    reviews.json, reviews.1.json, reviews.2.json, ...
+
+    Si "compress" es True, los ficheros se comprimen con gzip (se añade la extensión ".gz").
+    Si "append" es True, los objetos se añaden al final del último fichero escrito anteriormente (el de
+    mayor índice) si ya existe. En caso contrario, se borran los ficheros de escrituras anteriores.
+
+    El buffer solo se vuelca al escribir. Si no se escribe nada durante un tiempo, debe invocarse
+    periódicamente flush_if_needed para que los objetos no se queden en el buffer.
+    '''
+    def __init__(self, file_path, buffer_size = 1 << 20, flush_interval = 5,
+                 max_size = None, max_age = None, compress = False, append = False):
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+        self.append = append
+
+        self.file = None
+        self.file_index = None
+        self.file_size = 0
+        self.opened_at = None
+        self.last_flush = None
+        self.pending_flush = False
+
+
+    def get_file_path(self, index):
+        '''
+        Devuelve la ruta del fichero con el índice indicado.
+        :param index:
+        :return:
+        '''
+        file_path = self.file_path
+        if index > 0:
+            root, ext = splitext(file_path)
+            file_path = '{}.{}{}'.format(root, index, ext)
+        if self.compress:
+            file_path += '.gz'
+        return file_path
+
+
+    def get_last_file_index(self):
+        '''
+        Devuelve el índice del último fichero existente (0 si no existe ninguno)
+        :return:
+        '''
+        index = 0
+        while exists(self.get_file_path(index + 1)):
+            index += 1
+        return index
+
+
+    def remove_file_parts(self):
+        '''
+        Borra los ficheros numerados (reviews.1.json, reviews.2.json, ...) de escrituras anteriores.
+        '''
+        for index in range(self.get_last_file_index(), 0, -1):
+            remove(self.get_file_path(index))
+
+
+    def open(self):
+        '''
+        Abre el fichero en el que se escribirán los objetos. La primera vez, si "append" es True, se abre
+        el último fichero existente y se continúa escribiendo al final. Si no, se borran los ficheros
+        de escrituras anteriores y se empieza por el primero.
+        '''
+        if self.file_index is None:
+            if self.append:
+                self.file_index = self.get_last_file_index()
+            else:
+                self.remove_file_parts()
+                self.file_index = 0
+
+        file_path = self.get_file_path(self.file_index)
+        mode = 'ab' if self.append else 'wb'
+        # Si el fichero está comprimido, se usa su tamaño comprimido (el tamaño sin comprimir
+        # requeriría descomprimirlo entero)
+        self.file_size = getsize(file_path) if self.append and exists(file_path) else 0
+        if self.compress:
+            self.file = BufferedWriter(gzip.open(file_path, mode), self.buffer_size)
+        else:
+            self.file = open(file_path, mode, buffering = self.buffer_size)
+        self.opened_at = self.last_flush = monotonic()
+        self.pending_flush = False
+
+
+    def write(self, data):
+        '''
+        Escribe un objeto en el fichero.
+        :param data:
+        :return:
+        '''
+        if self.file is None:
+            self.open()
+        elif self.needs_rotation():
+            self.rotate()
+
+        line = serialize(data) + b'\n'
+        self.file.write(line)
+        self.file_size += len(line)
+        self.pending_flush = True
+
+        self.flush_if_needed()
+
+
+    def needs_rotation(self):
+        return (not self.max_size is None and self.file_size >= self.max_size) or \
+               (not self.max_age is None and monotonic() - self.opened_at >= self.max_age)
+
+
+    def rotate(self):
+        '''
+        Cierra el fichero actual y abre el siguiente.
+        '''
+        self.close()
+        self.file_index += 1
+        self.open()
+
+
+    def flush_if_needed(self):
+        '''
+        Vuelca el buffer en el fichero si tiene objetos sin volcar y han pasado "flush_interval"
+        segundos desde el último volcado.
+        '''
+        if self.pending_flush and monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+
+    def flush(self):
+        '''
+        Vuelca el buffer en el fichero.
+        '''
+        self.last_flush = monotonic()
+        self.pending_flush = False
+        if not self.file is None:
+            self.file.flush()
+            if self.compress:
+                # El buffer se vuelca en el fichero gzip, que tiene su propio buffer.
+                self.file.raw.flush()
+
+
+    def close(self):
+        '''
+        Vuelca el buffer y cierra el fichero.
+        '''
+        if not self.file is None:
+            try:
+                self.file.close()
+            finally:
+                self.file = None
@@ -24,7 +24,9 @@ SOFTWARE.
 
 from os.path import join, dirname
 import json
-from .item_db import TripAdvisorDB
+from .db_writer import TripAdvisorDBWriter
+from .ndjson_writer import NDJSONWriter
+from twisted.internet.task import LoopingCall
 from .spiders.tripadvisor_hotel_spider import TripAdvisorHotelSpider
 from TripAdvisorScraper.config.config import GlobalConfig
 import logging
@@ -34,7 +36,8 @@ import logging
 class TripAdvisorPipelineJSON:
     '''
     Esta clase permite almacenar los datos escrapeados de TripAdvisor
-    en ficheros JSON
+    en ficheros JSON (un item por línea). Se usa un fichero por cada tipo de item, que se mantiene
+    abierto durante todo el escrapeo (ver NDJSONWriter)
     '''
 
     def __init__(self):
@@ -45,34 +48,67 @@ class TripAdvisorPipelineJSON:
             'TripAdvisorHotelDeals' : config.get_path('OUTPUT_DEALS_JSON'),
             'TripAdvisorHotelGeolocation' : config.get_path('OUTPUT_GEO_JSON')
         }
+        self.writers = {}
+        self.flush_task = None
 
 
-    def get_file(self, item):
+    def get_writer(self, item):
         '''
-        Devuelve la ruta del fichero donde se almacenará el item que se indica como
+        Devuelve el objeto que escribe en el fichero donde se almacenará el item que se indica como
         parámetro
         :param item:
         :return:
         '''
-        feed_file = (self.files[item.__class__.__name__]
-                     if item.__class__.__name__ in self.files
-                     else None)
-        return feed_file
+        return self.writers.get(item.__class__.__name__)
 
 
     def open_spider(self, spider):
         if not isinstance(spider, TripAdvisorHotelSpider):
             return
-        for file_path in self.files.values():
+        config = GlobalConfig()
+        for item_type, file_path in self.files.items():
             if not file_path is None:
+                writer = NDJSONWriter(file_path,
+                                      buffer_size = config.get_value('OUTPUT_JSON_BUFFER_SIZE', 1 << 20),
+                                      flush_interval = config.get_value('OUTPUT_JSON_FLUSH_INTERVAL', 5),
+                                      max_size = config.get_value('OUTPUT_JSON_MAX_FILE_SIZE'),
+                                      max_age = config.get_value('OUTPUT_JSON_MAX_FILE_AGE'),
+                                      compress = config.is_true('OUTPUT_JSON_GZIP'),
+                                      append = config.is_true('INCREMENTAL_CRAWL'))
                 try:
-                    with open(file_path, 'wb'):
-                        pass
-                except:
-                    pass
+                    writer.open()
+                except OSError as e:
+                    spider.logger.error('Failed to open JSON output file "{}": {}'.format(file_path, str(e)))
+                    continue
+                self.writers[item_type] = writer
+
+        # Los buffers se vuelcan periódicamente aunque no se escrapeen items (e.g: mientras se esperan
+        # las respuestas de Splash)
+        flush_interval = config.get_value('OUTPUT_JSON_FLUSH_INTERVAL', 5)
+        if len(self.writers) > 0 and not flush_interval is None and flush_interval > 0:
+            self.flush_task = LoopingCall(self.flush_writers, spider)
+            self.flush_task.start(flush_interval, now = False)
+
+    def flush_writers(self, spider):
+        for writer in self.writers.values():
+            try:
+                writer.flush_if_needed()
+            except OSError as e:
+                spider.logger.error('Failed to flush JSON output file "{}": {}'.format(writer.file_path, str(e)))
 
     def close_spider(self, spider):
-        pass
+        if not isinstance(spider, TripAdvisorHotelSpider):
+            return
+        if not self.flush_task is None:
+            if self.flush_task.running:
+                self.flush_task.stop()
+            self.flush_task = None
+        for writer in self.writers.values():
+            try:
+                writer.close()
+            except OSError as e:
+                spider.logger.error('Failed to close JSON output file "{}": {}'.format(writer.file_path, str(e)))
+        self.writers = {}
 
     def process_item(self, item, spider):
         '''
@@ -85,13 +121,12 @@ class TripAdvisorPipelineJSON:
 
         # Almacenamos el item en su fichero correspondiente
         if not item is None and isinstance(spider, TripAdvisorHotelSpider):
-            file = self.get_file(item)
-            if not file is None:
+            writer = self.get_writer(item)
+            if not writer is None:
                 try:
-                    with open(file, 'a') as item_file_handler:
-                        print(json.dumps(dict(item)), file = item_file_handler)
-                except:
-                    pass
+                    writer.write(dict(item))
+                except OSError as e:
+                    spider.logger.error('Failed to write item to JSON output file "{}": {}'.format(writer.file_path, str(e)))
         return item
 
 
@@ -101,26 +136,30 @@ class TripAdvisorPipelineDB:
     '''
     Esta clase permite almacenar los items scrapeados de TripAdvisor en una base de datos
     sqlite.
+    Los items se almacenan en un hilo aparte (ver TripAdvisorDBWriter). Un item termina de procesarse
+    en cuanto se encola para el hilo (no espera a que se confirme su inserción). Al cerrar la araña,
+    se espera a que se hayan almacenado todos los items encolados.
     '''
+    def __init__(self):
+        self.writer = None
+
     def open_spider(self, spider):
         if not isinstance(spider, TripAdvisorHotelSpider):
             return
 
         db_path = GlobalConfig().get_path('OUTPUT_SQLITE')
-        try:
-            if db_path is None:
-                raise Exception()
-            self.db = TripAdvisorDB(db_path)
-            self.db.reset()
-        except:
-            self.db = None
+        if db_path is None:
+            return
+        # En el modo incremental se conservan los datos de las ejecuciones anteriores.
+        self.writer = TripAdvisorDBWriter(db_path, reset = not GlobalConfig().is_true('INCREMENTAL_CRAWL'))
+        return self.writer.open()
 
 
     def close_spider(self, spider):
         if not isinstance(spider, TripAdvisorHotelSpider):
             return
-        if not self.db is None:
-            self.db.close()
+        if not self.writer is None:
+            return self.writer.close()
 
 
     def process_item(self, item, spider):
@@ -130,8 +169,8 @@ class TripAdvisorPipelineDB:
         :param spider:
         :return:
         '''
-        if not item is None and isinstance(spider, TripAdvisorHotelSpider) and not self.db is None:
-            self.db.save_item(item)
+        if not item is None and isinstance(spider, TripAdvisorHotelSpider) and not self.writer is None:
+            return self.writer.write(item)
 
         return item
 
@@ -165,26 +204,106 @@ class TripAdvisorPipelineBulkJSON:
         }
     ]
 
-    El fichero JSON se generará cuando se hayan scrapeado todos los datos.
+    Los datos de cada hotel se mantienen en memoria hasta que la araña indica que se han escrapeado
+    todos (item TripAdvisorHotelCompleted). Entonces se escriben en el fichero (un hotel por línea)
+    y se liberan, de manera que el fichero se va generando durante el escrapeo.
+    Al cerrar la araña, se escriben los hoteles que no se han completado (e.g: porque alguna request falló)
+    y se cierra la lista.
+    En el modo incremental (INCREMENTAL_CRAWL), el fichero solo contiene los hoteles escrapeados en la
+    ejecución actual, con sus reviews nuevas.
     '''
-    def close_spider(self, spider):
+    def __init__(self):
+        self.file = None
+        self.num_hotels = 0
+
+        # Datos de los hoteles que aún no se han completado, indexados por la id del hotel.
+        self.hotels = {}
+
+    def open_spider(self, spider):
         if not isinstance(spider, TripAdvisorHotelSpider):
             return
 
-        config = GlobalConfig()
-        db_path = config.get_path('OUTPUT_SQLITE')
-        file_path = config.get_path('OUTPUT_BULK_JSON')
-        if not db_path is None and not file_path is None:
-            try:
-                with TripAdvisorDB(db_path) as db:
-                    data = db.get_everything()
-                    with open(file_path, 'w') as fh:
-                        fh.write(json.dumps(data))
-            except:
-                pass
+        file_path = GlobalConfig().get_path('OUTPUT_BULK_JSON')
+        if file_path is None:
+            return
+        self.file = open(file_path, 'w')
+        self.file.write('[\n')
+        self.num_hotels = 0
+        self.hotels = {}
 
-    def open_spider(self, spider):
-        pass
+    def close_spider(self, spider):
+        if not isinstance(spider, TripAdvisorHotelSpider) or self.file is None:
+            return
+
+        try:
+            for hotel_id in list(self.hotels.keys()):
+                self.write_hotel(hotel_id)
+            self.file.write('\n]\n')
+        finally:
+            self.file.close()
+            self.file = None
+
+    def get_hotel(self, hotel_id):
+        if not hotel_id in self.hotels:
+            self.hotels[hotel_id] = {
+                'info' : None,
+                'geo' : None,
+                'reviews' : [],
+                'deals' : []
+            }
+        return self.hotels[hotel_id]
+
+    def write_hotel(self, hotel_id):
+        '''
+        Escribe los datos de un hotel en el fichero y los libera. Si no se ha escrapeado la información
+        del hotel, se descartan sus datos.
+        :param hotel_id:
+        :return:
+        '''
+        hotel = self.hotels.pop(hotel_id, None)
+        if hotel is None or hotel['info'] is None:
+            return
+
+        hotel_data = {
+            'info' : dict(hotel['info'], geo = hotel['geo']),
+            'reviews' : hotel['reviews'],
+            'deals' : hotel['deals']
+        }
+        if self.num_hotels > 0:
+            self.file.write(',\n')
+        self.file.write(json.dumps(hotel_data))
+        self.file.flush()
+        self.num_hotels += 1
 
     def process_item(self, item, spider):
+        if item is None or not isinstance(spider, TripAdvisorHotelSpider) or self.file is None:
+            return item
+
+        item_type = item.__class__.__name__
+        if item_type == 'TripAdvisorHotelCompleted':
+            self.write_hotel(item['hotel_id'])
+        elif item_type == 'TripAdvisorHotelInfo':
+            self.get_hotel(item['id'])['info'] = {
+                'name' : item.get('name'),
+                'phone_number' : item.get('phone_number'),
+                'amenities' : item.get('amenities'),
+                'address' : item.get('address')
+            }
+        elif item_type == 'TripAdvisorHotelGeolocation':
+            self.get_hotel(item['hotel_id'])['geo'] = {
+                'latitude' : item.get('latitude'),
+                'longitude' : item.get('longitude')
+            }
+        elif item_type == 'TripAdvisorHotelReview':
+            self.get_hotel(item['hotel_id'])['reviews'].append({
+                'title' : item.get('title'),
+                'rating' : item.get('rating'),
+                'text' : item.get('text'),
+                'date' : item.get('date')
+            })
+        elif item_type == 'TripAdvisorHotelDeals':
+            self.get_hotel(item['hotel_id'])['deals'].append({
+                'provider_name' : item.get('provider_name'),
+                'price' : item.get('price')
+            })
         return item
\ No newline at end of file
@@ -0,0 +1,213 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Este módulo define una caché persistente para las páginas descargadas por el scraper (renderizadas
+con Splash o no), que se usa como backend de la caché HTTP de Scrapy (HTTPCACHE_STORAGE)
+
+Las páginas se almacenan comprimidas en una única base de datos sqlite. Cada página se identifica por
+su url y por el código del script LUA usado para renderizarla (ver splash_utils.splash_request), de
+forma que volver a ejecutar el scraper no vuelve a renderizar páginas que ya se obtuvieron.
+'''
+
+import sqlite3
+import zlib
+from time import time, monotonic
+from hashlib import sha256
+from os.path import join
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+
+# Cabecera con la que los scripts de Splash marcan las páginas en las que alguna acción ha fallado o
+# no ha terminado a tiempo (ver splash_utils.LuaSplashScript). Estas páginas no se cachean.
+RENDER_FAILED_HEADER = 'X-Render-Failed'
+
+
+def get_render_cache_key(url, lua_source = None):
+    '''
+    Calcula la clave con la que se almacena una página en la caché.
+    :param url: Es la url de la página
+    :param lua_source: Es el código del script LUA usado para renderizar la página con Splash
+    (None si no se usa Splash)
+    :return:
+    '''
+    hasher = sha256()
+    hasher.update(url.encode())
+    if not lua_source is None:
+        hasher.update(b'\n')
+        hasher.update(lua_source.encode())
+    return hasher.hexdigest()
+
+
+class SQLiteRenderCacheStorage:
+    '''
+    Backend de la caché HTTP de Scrapy que almacena las páginas en una base de datos sqlite.
+
+    Solo se cachean las requests que indican el tipo de página en el metadato "render_cache_type"
+    (e.g: "search", "hotel", "reviews"). El tiempo que una página permanece en la caché depende de su
+    tipo (variable "RENDER_CACHE_TTL"). Si el tamaño de las páginas almacenadas supera
+    "RENDER_CACHE_MAX_SIZE" bytes, se eliminan las páginas que se usaron hace más tiempo.
+    No se cachean las páginas renderizadas con Splash en las que alguna acción ha fallado (cabecera
+    RENDER_FAILED_HEADER)
+
+    Los cambios se confirman en la base de datos cada "RENDER_CACHE_COMMIT_SIZE" páginas almacenadas o
+    cada "RENDER_CACHE_COMMIT_INTERVAL" segundos, y al cerrar la araña.
+    '''
+
+    def __init__(self, settings):
+        self.cache_dir = data_path(settings['HTTPCACHE_DIR'], createdir = True)
+        self.ttls = settings.getdict('RENDER_CACHE_TTL')
+        self.default_ttl = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_size = settings.getint('RENDER_CACHE_MAX_SIZE')
+        self.compression_level = settings.getint('RENDER_CACHE_COMPRESSION_LEVEL', 6)
+        self.commit_size = settings.getint('RENDER_CACHE_COMMIT_SIZE', 50)
+        self.commit_interval = settings.getfloat('RENDER_CACHE_COMMIT_INTERVAL', 10)
+        self.db = None
+        self.pending_commits = 0
+        self.last_commit = None
+
+    def open_spider(self, spider):
+        self.db = sqlite3.connect(join(self.cache_dir, '{}.render_cache.db'.format(spider.name)))
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS render_cache (
+                key TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status INT NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                size INT NOT NULL,
+                created FLOAT NOT NULL,
+                accessed FLOAT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS render_cache_accessed ON render_cache(accessed);
+            """)
+        self.size, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM render_cache').fetchone()
+        self.pending_commits = 0
+        self.last_commit = monotonic()
+
+    def close_spider(self, spider):
+        if not self.db is None:
+            self.commit(force = True)
+            self.db.close()
+            self.db = None
+
+    def commit(self, force = False):
+        '''
+        Confirma los cambios pendientes si se han almacenado "commit_size" páginas o han pasado
+        "commit_interval" segundos desde la última confirmación.
+        :param force: Si es True, se confirman los cambios en cualquier caso.
+        '''
+        if force or self.pending_commits >= self.commit_size or monotonic() - self.last_commit >= self.commit_interval:
+            self.db.commit()
+            self.pending_commits = 0
+            self.last_commit = monotonic()
+
+    def get_key(self, request):
+        if 'render_cache_key' in request.meta:
+            return request.meta['render_cache_key']
+        return get_render_cache_key(request.url)
+
+    def get_ttl(self, cache_type):
+        return int(self.ttls.get(cache_type, self.default_ttl))
+
+    def retrieve_response(self, spider, request):
+        '''
+        Devuelve la página cacheada para la request indicada, o None si no está en la caché o ha expirado.
+        '''
+        cache_type = request.meta.get('render_cache_type')
+        if cache_type is None:
+            return None
+
+        key = self.get_key(request)
+        register = self.db.execute('SELECT url, status, headers, body, size, created FROM render_cache WHERE key = ?;',
+                                   (key,)).fetchone()
+        if register is None:
+            return None
+
+        url, status, headers, body, size, created = register
+        now = time()
+        ttl = self.get_ttl(cache_type)
+        if ttl > 0 and now - created > ttl:
+            self.db.execute('DELETE FROM render_cache WHERE key = ?;', (key,))
+            self.size -= size
+            return None
+
+        self.db.execute('UPDATE render_cache SET accessed = ? WHERE key = ?;', (now, key))
+
+        headers = Headers(headers_raw_to_dict(headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers = headers, url = url, body = body)
+        return respcls(url = url, headers = headers, status = status, body = body)
+
+    def store_response(self, spider, request, response):
+        '''
+        Almacena en la caché la página descargada para la request indicada.
+        '''
+        cache_type = request.meta.get('render_cache_type')
+        if cache_type is None:
+            return
+        if not response.headers.get(RENDER_FAILED_HEADER) is None:
+            spider.logger.debug('Not caching {}: the page was not completely rendered'.format(response.url))
+            return
+
+        key = self.get_key(request)
+        headers = headers_dict_to_raw(response.headers)
+        body = zlib.compress(response.body, self.compression_level)
+        size = len(headers) + len(body)
+        now = time()
+
+        previous = self.db.execute('SELECT size FROM render_cache WHERE key = ?;', (key,)).fetchone()
+        if not previous is None:
+            self.size -= previous[0]
+
+        self.db.execute('INSERT OR REPLACE INTO render_cache (key, type, url, status, headers, body, size, created, accessed) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);',
+                        (key, cache_type, response.url, response.status, headers, body, size, now, now))
+        self.size += size
+        self.pending_commits += 1
+
+        if self.max_size > 0 and self.size > self.max_size:
+            self.evict()
+        self.commit()
+
+    def evict(self):
+        '''
+        Elimina las páginas que se usaron hace más tiempo hasta que el tamaño de la caché quede por
+        debajo del 90% del tamaño máximo.
+        '''
+        target_size = self.max_size * 0.9
+        cursor = self.db.execute('SELECT key, size FROM render_cache ORDER BY accessed ASC;')
+        evicted = []
+        for key, size in cursor:
+            if self.size <= target_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        cursor.close()
+        self.db.executemany('DELETE FROM render_cache WHERE key = ?;', evicted)
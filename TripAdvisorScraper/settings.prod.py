@@ -25,6 +25,8 @@ ROBOTSTXT_OBEY = False
 # Configuración de Splash
 
 DOWNLOADER_MIDDLEWARES = {
+    'TripAdvisorScraper.middlewares.GeocodeLaneDownloaderMiddleware': 560,
+    'TripAdvisorScraper.middlewares.SplashPoolMiddleware': 720,
     'scrapy_splash.SplashCookiesMiddleware': 723,
     'scrapy_splash.SplashMiddleware': 725,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
@@ -32,13 +34,65 @@ DOWNLOADER_MIDDLEWARES = {
 
 SPIDER_MIDDLEWARES = {
     'scrapy_splash.SplashDeduplicateArgsMiddleware': 100,
+    'TripAdvisorScraper.middlewares.GeocodeLaneSpiderMiddleware': 540,
 }
 
 DUPEFILTER_CLASS = 'scrapy_splash.SplashAwareDupeFilter'
-HTTPCACHE_STORAGE = 'scrapy_splash.SplashAwareFSCacheStorage'
+
+
+# Configuración de la caché de páginas (ver TripAdvisorScraper.render_cache)
+
+HTTPCACHE_ENABLED = True
+HTTPCACHE_STORAGE = 'TripAdvisorScraper.render_cache.SQLiteRenderCacheStorage'
+HTTPCACHE_IGNORE_HTTP_CODES = [403, 404, 429, 500, 502, 503, 504]
+
+# Tiempo en segundos que permanece cada tipo de página en la caché (0 para no expirar)
+RENDER_CACHE_TTL = {
+    'search' : 6 * 3600,
+    'hotel' : 24 * 3600,
+    'reviews' : 7 * 24 * 3600
+}
+
+# Tamaño máximo en bytes de la caché de páginas (0 para no limitarlo)
+RENDER_CACHE_MAX_SIZE = 2 * 1024 ** 3
+
+# Las páginas almacenadas en la caché se confirman en la base de datos cada RENDER_CACHE_COMMIT_SIZE
+# páginas o cada RENDER_CACHE_COMMIT_INTERVAL segundos (y al terminar)
+RENDER_CACHE_COMMIT_SIZE = 50
+RENDER_CACHE_COMMIT_INTERVAL = 10
 
 SPLASH_URL = 'http://splashproxy.herokuapp.com:80/'
 
+# Instancias de Splash entre las que se reparten las requests (ver SplashPoolMiddleware)
+# Si no se indica, se usa solo SPLASH_URL
+SPLASH_URLS = [
+    SPLASH_URL,
+]
+
+# Número de veces que se reintenta una request de Splash en otra instancia si falla.
+SPLASH_POOL_MAX_RETRIES = 2
+
+# Una instancia de Splash se expulsa del pool durante SPLASH_POOL_EJECT_TIME segundos
+# si falla SPLASH_POOL_MAX_CONSECUTIVE_ERRORS veces seguidas.
+SPLASH_POOL_MAX_CONSECUTIVE_ERRORS = 3
+SPLASH_POOL_EJECT_TIME = 30
+
+
+
+# Configuración del carril de las requests de geolocalización (ver GeocodeLane)
+
+# Número máximo de requests por segundo a la API de Google Maps (0 para no limitarlo) y ráfaga máxima
+GEOCODE_RATE_LIMIT = 10
+GEOCODE_BURST = 10
+
+# Número máximo de requests simultáneas a la API de Google Maps
+GEOCODE_MAX_IN_FLIGHT = 4
+
+# Número de reintentos de una request fallida y tiempo de espera (en segundos) antes del primer
+# reintento (se duplica en cada reintento)
+GEOCODE_MAX_RETRIES = 3
+GEOCODE_RETRY_BACKOFF = 1
+
 
 
 # Configuración de los pipelines
@@ -25,9 +25,33 @@ from scrapy import Request
 from urllib.parse import urlencode
 from .splash_utils import *
 from os.path import dirname, join
+from functools import lru_cache
 from TripAdvisorScraper.config.config import GlobalConfig
 
 
+# Las acciones de Splash de cada tipo de request se construyen una única vez por cada combinación
+# de parámetros (y de tiempo máximo de espera de las acciones) y se reutilizan en todas las requests.
+
+@lru_cache(maxsize = None)
+def get_search_by_place_actions(place, timeout):
+    return TypeText('input.typeahead_input', place, timeout) +\
+           Click('#SUBMIT_HOTELS', timeout) +\
+           NavigationOrElementReady('div.meta_listing', timeout = timeout)
+
+
+@lru_cache(maxsize = 256)
+def get_search_results_page_actions(page_number, timeout):
+    if page_number is None or page_number == 1:
+        return ElementReady('div.pagination .pageNum.last', timeout)
+    return Click('div.pagination .pageNum[data-page-number="{}"]'.format(page_number), timeout) +\
+           ElementReady('div.pagination .pageNum.current[data-page-number="{}"]'.format(page_number), timeout)
+
+
+@lru_cache(maxsize = None)
+def get_hotel_deals_actions(timeout):
+    return ElementsReady(['div.premium_offers_area.viewDealChevrons'], timeout)
+
+
 class TripAdvisorRequests:
     '''
     Este clase es la encargada de gestionar la generación de requests a la página
@@ -105,16 +129,22 @@ class TripAdvisorRequests:
 
 
     @classmethod
-    def search_hotels_by_terms(cls, terms, callback):
+    def search_hotels_by_terms(cls, terms, callback, offset = None):
         '''
         Instancia una request sobre una página de búsqueda de hoteles. (Busca hoteles por términos)
         :param terms: Es un texto que indica los términos de búsqueda
         :param callback:
+        :param offset: Si se indica, es el índice del primer resultado de la página de búsqueda
         :return:
         Este método es un alias de
-        TripAdvisorRequests.request('Search', params = {'q' : terms})
+        TripAdvisorRequests.request('Search', params = {'q' : terms, 'o' : offset})
         '''
-        return cls.request(path = 'Search', callback = callback, params = {'q' : terms})
+        params = {'q' : terms}
+        if not offset is None:
+            params['o'] = offset
+        request = cls.request(path = 'Search', callback = callback, params = params)
+        request.meta['render_cache_type'] = 'search'
+        return request
 
 
 
@@ -129,13 +159,11 @@ class TripAdvisorRequests:
         provincia, distrito, ...
         :return:
         '''
-        actions = \
-            SendText('input.typeahead_input', place) +\
-            Click('#SUBMIT_HOTELS') +\
-            Wait(5)
-        #CHANGE LAST WAIT {TODO}
+        actions = get_search_by_place_actions(place, GlobalConfig().get_value('SPLASH_ACTION_TIMEOUT'))
 
-        return cls.splash_request(actions = actions, callback = callback)
+        request = cls.splash_request(actions = actions, callback = callback)
+        request.meta['render_cache_type'] = 'search'
+        return request
 
 
 
@@ -154,13 +182,11 @@ class TripAdvisorRequests:
         los hoteles de dicha página
         :return:
         '''
-        if page_number is None or page_number == 1:
-            actions = ElementReady('div.pagination .pageNum.last')
-        else:
-            actions = Click('div.pagination .pageNum[data-page-number="{}"]'.format(page_number))
-            actions += ElementReady('div.pagination .pageNum.current[data-page-number="{}"]'.format(page_number))
+        actions = get_search_results_page_actions(page_number, GlobalConfig().get_value('SPLASH_ACTION_TIMEOUT'))
 
-        return cls.splash_request(url = url, path = path, callback = callback, actions = actions, dont_filter = True)
+        request = cls.splash_request(url = url, path = path, callback = callback, actions = actions, dont_filter = True)
+        request.meta['render_cache_type'] = 'search'
+        return request
 
 
 
@@ -178,12 +204,13 @@ class TripAdvisorRequests:
         use_splash = fetch_deals
 
         if use_splash:
-            actions = ElementsReady([
-                'div.premium_offers_area.viewDealChevrons'
-            ])
-            return cls.splash_request(actions = actions, *args, **kwargs)
+            actions = get_hotel_deals_actions(GlobalConfig().get_value('SPLASH_ACTION_TIMEOUT'))
+            request = cls.splash_request(actions = actions, *args, **kwargs)
+        else:
+            request = cls.request(*args, **kwargs)
 
-        return cls.request(*args, **kwargs)
+        request.meta['render_cache_type'] = 'hotel'
+        return request
 
 
 
@@ -200,11 +227,12 @@ class GMapRequests:
     Esta clase provee una serie de métodos para hacer requests a la API de Google Maps
     '''
     @classmethod
-    def search_place(cls, address, callback):
+    def search_place(cls, address, callback, errback = None):
         '''
         Realiza una request a la API de Google Maps para buscar una localización o lugar.
         :param address: Es un lugar o dirección
         :param callback:
+        :param errback: Es un callback opcional que será invocado si la request falla.
         :return:
         '''
         api_key = GlobalConfig().get_value('GOOGLE_MAPS_API_KEY')
@@ -215,7 +243,16 @@ class GMapRequests:
 
         url = '{}?{}'.format(cls.get_root_url(), urlencode(params))
 
-        return Request(url = url, callback = callback)
+        # No se filtran como duplicadas: la araña ya solicita una única vez cada dirección y, si se
+        # descartasen, el hotel se quedaría esperando su geolocalización.
+        request = Request(url = url, callback = callback, errback = errback, dont_filter = True)
+
+        # Las requests a la API de Google Maps se envían por su propio carril, con su propio límite
+        # de velocidad y sus propios reintentos (ver middlewares.GeocodeLane)
+        request.meta['geocode_lane'] = True
+        request.meta['dont_retry'] = True
+        request.meta['download_slot'] = 'geocode'
+        return request
 
 
 
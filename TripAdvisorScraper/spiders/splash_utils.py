@@ -31,6 +31,9 @@ Se proveen las siguientes clases de utilidad, que representan posibles acciones
 
 - Wait(x) : Para x segundos
 - SendText(selector, text) : Escribe un texto a un elemento de tipo input indicando su selector 
+- TypeText(selector, text) : Igual que SendText, pero solo se teclea la última letra del texto
+- NavigationOrElementReady(selector, timeout) : Espera hasta que la página navega a otra url o
+    un elemento que encaje con el selector exista en el DOM de la página (como mucho "timeout" segundos)
 - Click(selector) : Clickea en un elemento indicando su selector
 - AllElementsReady([selector1, selector2, ...]) : Espera hasta que al menos un elemento que encaje
     con cada selector existan en el DOM de la página
@@ -57,12 +60,29 @@ yield splash_request(url = ..., callback = ..., actions = actions)
 from os.path import dirname, join
 from scrapy_splash import SplashRequest
 from urllib.parse import urlencode
+from functools import lru_cache
+from TripAdvisorScraper.config.config import GlobalConfig
+from TripAdvisorScraper.render_cache import get_render_cache_key, RENDER_FAILED_HEADER
 import logging
 
 
 
 # ----- FUNCIONES DE UTILIDAD ------
 
+@lru_cache(maxsize = None)
+def read_static_file(*path):
+    '''
+    Lee un fichero del directorio "static" del scraper. El contenido de los ficheros se lee una única
+    vez por proceso y se cachea.
+    e.g:
+    read_static_file('js', 'jquery.min.js')
+    :param path: Es la ruta del fichero relativa al directorio "static"
+    :return: Devuelve el contenido del fichero.
+    '''
+    with open(join(dirname(dirname(__file__)), 'static', *path)) as fh:
+        return fh.read()
+
+
 def stringify(values):
     '''
     Método de utilidad para convertir valores que serán hardcodeados dentro de trozos de
@@ -354,9 +374,15 @@ class DOMEventListenerCode(SplashWaitForResumeCode):
     Esta clase se encarga de generar el código en LUA para un script con el objetivo de
     pausar la ejecución del mismo hasta que un evento en el DOM de la web ocurra.
     No debe instanciarse. Cree objetos de alguna de sus subclases.
+
+    Si el evento no ocurre pasado el tiempo máximo de espera ("timeout" en segundos), se genera un
+    error en el script y no se realizan el resto de acciones (ver LuaSplashScript)
+    Por defecto, el tiempo máximo de espera es el de la variable de configuración "SPLASH_ACTION_TIMEOUT"
     '''
     def __init__(self, selectors = [], timeout = None):
         self.selectors = stringify(selectors)
+        if timeout is None:
+            timeout = GlobalConfig().get_value('SPLASH_ACTION_TIMEOUT')
 
 
         callback_method_name = '__callback'
@@ -389,14 +415,15 @@ class ElementsReady(DOMEventListenerCode):
     Espera a que haya al menos un párrafo, una lista y un elemento con la id "some-element"
 
     '''
-    def __init__(self, selectors = []):
+    def __init__(self, selectors = [], timeout = None):
         '''
         Inicializa la instancia.
         :param selectors: Es un conjunto de selectores para jQuery
         Si el script ejecuta el código generado, la ejecución se pausará hasta que al menos un
         elemento que encaje con cada selector indicado esté disponible en el DOM
+        :param timeout: Es el tiempo máximo de espera en segundos (ver DOMEventListenerCode)
         '''
-        super().__init__(selectors)
+        super().__init__(selectors, timeout)
 
     def get_register_callback_code(self, callback_method_name):
         return JSFunctionCallCode(name = 'allElementsAvaliable',
@@ -407,8 +434,8 @@ class ElementReady(ElementsReady):
     '''
     Es igual que ElementsReady, pero solo se especifica un selector.
     '''
-    def __init__(self, selector):
-        super().__init__([selector])
+    def __init__(self, selector, timeout = None):
+        super().__init__([selector], timeout)
 
 
 
@@ -417,15 +444,16 @@ class InputElementHasValue(DOMEventListenerCode):
     Esta clase genera código para un script. Al ser ejecutado tal código, pausa la ejecución
     hasta que un elemento (de tipo input), tenga el valor indicado como parámetro.
     '''
-    def __init__(self, selector, value):
+    def __init__(self, selector, value, timeout = None):
         '''
         Inicializa la instancia.
         :param selector: Es el selector del elemento
         :param value: Es el valor que debe tener el elemento antes de que la ejecución del script
         se reaunde
+        :param timeout: Es el tiempo máximo de espera en segundos (ver DOMEventListenerCode)
         '''
         self.value = value
-        super().__init__([selector])
+        super().__init__([selector], timeout)
 
     def get_value(self):
         return self.value
@@ -447,12 +475,13 @@ class Click(Code):
     Espera a que un elemento con el selector "my-button" esté en el DOM de la página y luego lo
     clickea.
     '''
-    def __init__(self, selector):
+    def __init__(self, selector, timeout = None):
         '''
         Inicializa la instancia
         :param selector: Es el selector del elemento
+        :param timeout: Es el tiempo máximo de espera en segundos hasta que el elemento esté disponible
         '''
-        code = ElementReady(selector) +\
+        code = ElementReady(selector, timeout) +\
                LuaObjectMethodCallCode(object = SplashGetElementCode(selector), method = 'mouse_click')
         super().__init__(code)
 
@@ -471,17 +500,80 @@ class SendText(Code):
     con el texto: $('#my-input').val() === 'Hello World!'
 
     '''
-    def __init__(self, selector, text):
+    def __init__(self, selector, text, timeout = None):
         '''
         Inicializa la instancia
         :param selector: Es el selector del elemento
         :param text: Es el texto ha escribir en el elemento
+        :param timeout: Es el tiempo máximo de espera en segundos hasta que el elemento esté disponible
+        y hasta que tenga el valor indicado
         '''
 
-        code = ElementReady(selector) +\
+        code = ElementReady(selector, timeout) +\
                LuaObjectMethodCallCode(object = SplashGetElementCode(selector), method = 'send_text', args = [text]) +\
-               InputElementHasValue(selector=selector, value=text)
+               InputElementHasValue(selector=selector, value=text, timeout=timeout)
+
+        super().__init__(code)
+
 
+class TypeText(Code):
+    '''
+    Es igual que SendText, pero más rápido: El texto se establece directamente como valor del input
+    salvo la última letra, que se teclea para que se disparen los eventos de teclado de la página
+    (e.g: para que aparezcan las sugerencias de un buscador)
+
+    e.g:
+    TypeText('#my-input', 'Hello World!')
+    '''
+    def __init__(self, selector, text, timeout = None):
+        '''
+        Inicializa la instancia
+        :param selector: Es el selector del elemento
+        :param text: Es el texto ha escribir en el elemento
+        :param timeout: Es el tiempo máximo de espera en segundos hasta que el elemento esté disponible
+        y hasta que tenga el valor indicado
+        '''
+        code = ElementReady(selector, timeout) +\
+               SplashRunCode(JSObjectMethodCallCode(object = 'jQuery({})'.format(stringify(selector)),
+                                                    method = 'val', args = [text[:-1]])) +\
+               LuaObjectMethodCallCode(object = SplashGetElementCode(selector), method = 'send_text', args = [text[-1:]]) +\
+               InputElementHasValue(selector=selector, value=text, timeout=timeout)
+
+        super().__init__(code)
+
+
+class NavigationOrElementReady(Code):
+    '''
+    Clase que genera código que pausa la ejecución del script hasta que la página navega a otra url
+    (y termina de cargarse) o hasta que un elemento que encaje con el selector indicado exista en el
+    DOM. Si ninguna de las dos cosas ocurre pasado el tiempo indicado, la ejecución continúa.
+
+    A diferencia de ElementReady, la condición se comprueba desde el script LUA, por lo que la espera
+    no se interrumpe si la página navega a otra url.
+
+    e.g:
+    Click('#submit') + NavigationOrElementReady('div.results', timeout = 10)
+    '''
+    def __init__(self, selector, timeout = 10, interval = 0.1):
+        '''
+        Inicializa la instancia
+        :param selector: Es el selector del elemento (selector CSS)
+        :param timeout: Es el tiempo máximo de espera en segundos.
+        :param interval: Es el intervalo en segundos con el que se comprueba la condición.
+        '''
+        element_ready = LuaObjectMethodCallCode(object = 'splash', method = 'evaljs', surround_with_assert = False,
+                                                args = ['document.querySelector({}) !== null'.format(stringify(selector))])
+        page_loaded = LuaObjectMethodCallCode(object = 'splash', method = 'evaljs', surround_with_assert = False,
+                                              args = ['document.readyState === "complete"'])
+        code = Code('do') +\
+               Code('local start_url = splash:url()') +\
+               Code('local elapsed = 0') +\
+               Code('while elapsed < {} do'.format(timeout)) +\
+               Code('if {} or (splash:url() ~= start_url and {}) then break end'.format(element_ready, page_loaded)) +\
+               Wait(interval) +\
+               Code('elapsed = elapsed + {}'.format(interval)) +\
+               Code('end') +\
+               Code('end')
         super().__init__(code)
 
 
@@ -505,6 +597,16 @@ class Wait(Code):
 
 
 
+class DebugOnlyCode(Code):
+    '''
+    Código que solo se ejecuta si el script usa el perfil de depuración. El perfil lo decide
+    LuaSplashScript (variable "debug_enabled" del script), de forma que los mensajes de depuración
+    y el panel donde se imprimen siempre van juntos.
+    '''
+    def __init__(self, code):
+        super().__init__(Code('if debug_enabled then') + code + Code('end'))
+
+
 class DebugMessage(Code):
     '''
     Esta clase genera un código para imprimir un mensaje de depuración en el DOM de la página.
@@ -515,11 +617,11 @@ class DebugMessage(Code):
         '''
         Inicializa la instancia.
         :param message: Es un mensaje a imprimir
+        El mensaje solo se imprime si el script usa el perfil de depuración (ver LuaSplashScript)
         '''
-
         code = SplashRunCode(JSAppendHTMLToElementCode(selector = '#debug_messages',
                                                        arg = '<li>INFO: {}</li>'.format(message)))
-        super().__init__(code)
+        super().__init__(DebugOnlyCode(code))
 
 
 class JSDebugCode(Code):
@@ -530,13 +632,14 @@ class JSDebugCode(Code):
     Debug('len($("p"))') imprime el número de párrafos en el DOM en el panel de depuración.
     '''
     def __init__(self, js_code):
+        # El mensaje solo se imprime si el script usa el perfil de depuración (ver LuaSplashScript)
         code = SplashRunCode(JSAppendHTMLToElementCode(selector = '#debug_messages',
                                                        arg = '<li>{}</li>'.format(js_code)))
 
         text = '{} + {} + {}'.format(stringify('<li class="script-result">'), js_code , stringify('</li>'))
         code += SplashRunCode(JSAppendHTMLToElementCode(selector = '#debug_messages',
                                                         arg = NoEscape(text)))
-        super().__init__(code)
+        super().__init__(DebugOnlyCode(code))
 
 class JSDebugElement(JSDebugCode):
     '''
@@ -564,10 +667,9 @@ class DebugPanel(Code):
                                                        arg = panel))
 
         # Añadimos estilos css al panel de depuración.
-        with open(join(dirname(dirname(__file__)), 'static', 'css', 'debug_panel.css')) as fh:
-            styles = fh.read()
-            code += SplashRunCode(JSAppendHTMLToElementCode(selector = 'body',
-                                                            arg = '<style>{}</style>'.format(styles)))
+        styles = read_static_file('css', 'debug_panel.css')
+        code += SplashRunCode(JSAppendHTMLToElementCode(selector = 'body',
+                                                        arg = '<style>{}</style>'.format(styles)))
 
         super().__init__(code)
 
@@ -580,20 +682,63 @@ class LuaSplashScript(Code):
     e.g:
     actions = Click('#first-element') + SendText('#second-element', 'some-value')
     script = LuaSplashScript(actions)
+
+    El script tiene dos perfiles:
+    - Depuración: Se añade el panel de depuración al DOM de la página (ver DebugPanel)
+    - Producción: No se añade el panel de depuración, no se cargan las imágenes de la página y
+    se eliminan del DOM los elementos que no se escrapean (estilos, svgs, ...) antes de devolverlo,
+    para reducir el tamaño de la respuesta.
+
+    Si alguna de las acciones falla (e.g: se supera el tiempo máximo de espera de un elemento) o se
+    supera el tiempo máximo para realizar todas las acciones, no se realizan el resto de acciones,
+    pero el script devuelve igualmente el DOM de la página tal y como esté en ese momento, con la
+    cabecera RENDER_FAILED_HEADER (ver render_cache.SQLiteRenderCacheStorage)
     '''
-    def __init__(self, actions = None):
+    def __init__(self, actions = None, debug = None, timeout = None):
         '''
         Inicializa la instancia.
         :param actions: Son las acciones a realizar por el script.
+        :param debug: Indica si se usa el perfil de depuración. Por defecto, se usa si la variable
+        de configuración "ENABLE_DEBUG" está activa.
+        :param timeout: Es el tiempo máximo en segundos para realizar todas las acciones. Por defecto
+        no hay límite.
         '''
 
         if actions is None:
             actions = Code()
-        debug_panel = DebugPanel()
-        main_method_body = LuaObjectMethodCallCode(object = 'splash', method = 'go', args = [NoEscape('splash.args.url')]) +\
-                           LuaObjectMethodCallCode(object = 'splash', method = 'runjs', args = [NoEscape('splash.args.jquery')]) +\
-                           LuaObjectMethodCallCode(object = 'splash', method = 'runjs', args = [NoEscape('splash.args.scrap_utils')]) + \
-                           debug_panel + actions
+        if debug is None:
+            debug = GlobalConfig().is_true('ENABLE_DEBUG')
+
+        main_method_body = Code('local debug_enabled = {}'.format('true' if debug else 'false'))
+        if not debug:
+            main_method_body += Code('splash.images_enabled = false')
+
+        main_method_body += LuaObjectMethodCallCode(object = 'splash', method = 'go', args = [NoEscape('splash.args.url')]) +\
+                            LuaObjectMethodCallCode(object = 'splash', method = 'runjs', args = [NoEscape('splash.args.jquery')]) +\
+                            LuaObjectMethodCallCode(object = 'splash', method = 'runjs', args = [NoEscape('splash.args.scrap_utils')])
+
+        if debug:
+            main_method_body += DebugPanel()
+
+        # Si alguna acción falla, se devuelve el DOM tal y como esté, pero la respuesta se marca con la
+        # cabecera RENDER_FAILED_HEADER para que no se almacene en la caché de páginas.
+        actions = LuaFunctionCode(body = actions)
+        if timeout is None:
+            main_method_body += Code('local actions_ok = pcall({})'.format(actions))
+        else:
+            main_method_body += Code('local actions_ok = {}'.format(
+                LuaObjectMethodCallCode(object = 'splash', method = 'with_timeout',
+                                        args = [NoEscape(actions), timeout], surround_with_assert = False)))
+        main_method_body += Code('if not actions_ok then') +\
+                            LuaObjectMethodCallCode(object = 'splash', method = 'set_result_header',
+                                                    args = [RENDER_FAILED_HEADER, '1'], surround_with_assert = False) +\
+                            Code('end')
+
+        if not debug:
+            # No se usa jQuery porque la página puede haber navegado a otra url durante las acciones.
+            main_method_body += SplashRunCode(JSFunctionCallCode(name = 'Array.prototype.forEach.call', args = [
+                NoEscape('document.querySelectorAll("style, link, noscript, svg")'),
+                NoEscape('function (element) { element.parentNode.removeChild(element); }')]))
 
         code = LuaFunctionCode(name = 'main', params = ['splash'],
                                body = main_method_body,
@@ -606,7 +751,55 @@ class LuaSplashScript(Code):
         super().__init__(code)
 
 
-def splash_request(url, callback, actions = None, **kwargs):
+@lru_cache(maxsize = 256)
+def _compile_lua_script(actions_code, debug, timeout):
+    return str(LuaSplashScript(Code(actions_code), debug, timeout))
+
+
+def compile_lua_script(actions = None, debug = None, timeout = None):
+    '''
+    Genera el código del script en LUA que ejecuta la secuencia de acciones indicada (ver LuaSplashScript)
+    El código generado se memoriza por cada secuencia de acciones distinta, de forma que no se
+    vuelve a generar para requests que ejecutan las mismas acciones.
+    :param actions: Son las acciones a realizar por el script.
+    :param debug: Indica si se usa el perfil de depuración del script (ver LuaSplashScript)
+    :param timeout: Es el tiempo máximo en segundos para realizar las acciones (ver LuaSplashScript)
+    :return: Devuelve el código del script (un string)
+    '''
+    if debug is None:
+        debug = GlobalConfig().is_true('ENABLE_DEBUG')
+    if not isinstance(actions, Code):
+        return _compile_lua_script(str(actions) if not actions is None else '', debug, timeout)
+
+    # Los scripts también se guardan en el propio objeto de las acciones, de forma que si las acciones
+    # se reutilizan (ver requests.py), no es necesario volver a calcular la clave de la caché.
+    if getattr(actions, 'lua_scripts', None) is None:
+        actions.lua_scripts = {}
+    scripts = actions.lua_scripts
+    if not (debug, timeout) in scripts:
+        scripts[(debug, timeout)] = _compile_lua_script(str(actions), debug, timeout)
+    return scripts[(debug, timeout)]
+
+
+def get_splash_cache_args():
+    '''
+    Devuelve los argumentos de las requests de Splash que se envían cacheados (cache_args): solo se
+    envían al servidor la primera vez que se usan.
+    scrapy_splash recuerda qué argumentos ya se han enviado de forma global, no por cada instancia de
+    Splash. Si hay varias instancias (variable "SPLASH_URLS", ver SplashPoolMiddleware), las que no
+    tienen los argumentos responderían con error 498 y habría que repetir la request, así que en ese
+    caso no se cachea ningún argumento.
+    :return:
+    '''
+    urls = GlobalConfig().get_value('SPLASH_URLS')
+    if isinstance(urls, str):
+        urls = [url for url in urls.split(',') if len(url.strip()) > 0]
+    if not urls is None and len(urls) > 1:
+        return []
+    return ['lua_source', 'scrap_utils', 'jquery']
+
+
+def splash_request(url, callback, actions = None, timeout = None, **kwargs):
     '''
     Realiza una petición a la página cuya url se indica como parámetro y devuelve una instancia
     de la clase Request como valor de retorno.
@@ -623,20 +816,34 @@ def splash_request(url, callback, actions = None, **kwargs):
     :param callback: Es un callback que scrapeará la página
     :param actions: Es un listado de acciones a realizar antes de servir la página. Permite crear
     un usuario virtual que pueda interactuar con la web para cargar contenido dinámico.
-    '''
-
-    def read_js_script(path):
-        with open(join(dirname(dirname(__file__)), 'static', 'js', path)) as fh:
-            return fh.read()
-
-    code = LuaSplashScript(actions)
-
-    return SplashRequest(callback=callback,
-                         endpoint='execute',
-                         args={
-                             'lua_source': str(code),
-                             'url': url,
-                             'scrap_utils': read_js_script('scrap_utils.js'),
-                             'jquery': read_js_script('jquery.min.js')
-                         },
-                         **kwargs)
\ No newline at end of file
+    :param timeout: Es el tiempo máximo en segundos para realizar las acciones. Si se supera, se
+    sirve la página tal y como esté en ese momento. Por defecto es el valor de la variable de
+    configuración "SPLASH_REQUEST_TIMEOUT"
+
+    El script y los ficheros JS se envían como argumentos cacheados en Splash si solo hay una
+    instancia de Splash (ver get_splash_cache_args)
+    La página renderizada se identifica en la caché de páginas por la url y el código del script
+    (ver render_cache.SQLiteRenderCacheStorage)
+    '''
+    if timeout is None:
+        timeout = GlobalConfig().get_value('SPLASH_REQUEST_TIMEOUT')
+
+    lua_source = compile_lua_script(actions, timeout = timeout)
+    args = {
+        'lua_source': lua_source,
+        'url': url,
+        'scrap_utils': read_static_file('js', 'scrap_utils.js'),
+        'jquery': read_static_file('js', 'jquery.min.js')
+    }
+    # Splash aborta el render si se supera su propio timeout, así que se deja margen para cargar
+    # la página antes de realizar las acciones.
+    if not timeout is None:
+        args['timeout'] = timeout + GlobalConfig().get_value('SPLASH_PAGE_LOAD_TIMEOUT', 30)
+
+    request = SplashRequest(callback=callback,
+                            endpoint='execute',
+                            args=args,
+                            cache_args=get_splash_cache_args(),
+                            **kwargs)
+    request.meta['render_cache_key'] = get_render_cache_key(url, lua_source)
+    return request
@@ -28,20 +28,61 @@ from urllib.parse import urlencode
 from scrapy.selector import Selector
 from itertools import chain
 from hashlib import sha256
-from re import match
-from TripAdvisorScraper.items import TripAdvisorHotelInfo, TripAdvisorHotelReview, TripAdvisorHotelDeals, TripAdvisorHotelGeolocation
-from os.path import dirname, join
+from re import match, compile
+from TripAdvisorScraper.items import TripAdvisorHotelInfo, TripAdvisorHotelReview, TripAdvisorHotelDeals, TripAdvisorHotelGeolocation, TripAdvisorHotelCompleted
+from os.path import dirname, join, exists
 from datetime import datetime
+from time import time
 from .requests import *
 import json
 import webbrowser
 from TripAdvisorScraper.logger import Logger
+from TripAdvisorScraper.geocode_cache import GeocodeCache, normalize_address
+from TripAdvisorScraper.item_db import TripAdvisorDB
 from TripAdvisorScraper.config.config import GlobalConfig, Config
 
 class TripAdvisorHotelSpider(Spider):
     # Nombre de nuestra araña
     name = 'TripAdvisorHotelSpider'
 
+    # Expresión regular para parsear las fechas de las reviews e.g: "October 18, 2017"
+    review_date_regex = compile('^[ ]*([^ ]+)[ ]+(\d+)[ ]*\,[ ]*([^ ]+)[ ]*$')
+
+    # Expresión regular para extraer la ruta de los hoteles del atributo "onclick" de los resultados
+    # de una búsqueda por términos.
+    search_result_onclick_regex = compile('\\([ ]*\'[^\']*\'[ ]*,[ ]*\'[^\']*\'[ ]*,[ ]*\'[^\']*\'[ ]*,[ ]*[^\\,]*[ ]*,[ ]*\'\\/([^\']+)\'')
+
+    # Expresión regular para separar la ruta y los parámetros de la url de un resultado de búsqueda.
+    search_result_path_regex = compile('^([^\\?]*)(\\?(.*))?$')
+
+    # Expresión regular para dividir la url de una página de reviews de un hotel en tres partes: lo que
+    # hay antes del offset de las reviews, el propio offset ("or{offset}-") y lo que hay después.
+    review_page_url_regex = compile('^(.*\/[^-]+\-[^-]+\-[^-]+\-[^-]+\-)(or\d+\-)?(.*)$')
+
+    # Expresión regular para dividir la ruta de una página de resultados de una búsqueda por localización
+    # en tres partes: lo que hay antes del offset de los resultados, el propio offset ("oa{offset}") y
+    # lo que hay después. e.g: /Hotels-g187520-oa30-Pamplona_Navarra-Hotels.html
+    search_page_url_regex = compile('^\/?(.*\-)oa(\d+)(\-.*)$')
+
+    # Expresión regular para extraer la id de la localización y la id del hotel de la url de cualquier
+    # página de un hotel, e.g: /Hotel_Review-g187520-d233664-Reviews-or5-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html
+    hotel_url_regex = compile('\-g(\d+)\-d(\d+)(?:\-|\.|$)')
+
+    # Expresiones regulares para extraer las coordenadas de un hotel del JSON embebido en los scripts
+    # de su página, e.g: "latitude":"42.81","longitude":"-1.64" o lat: 42.81, lng: -1.64
+    coordinates_regexes = [
+        compile('"latitude"\s*:\s*"?(-?\d+(?:\.\d+)?)"?\s*,\s*"longitude"\s*:\s*"?(-?\d+(?:\.\d+)?)'),
+        compile('\\blat["\']?\s*:\s*(-?\d+\.\d+)\s*,\s*["\']?(?:lng|lon)["\']?\s*:\s*(-?\d+\.\d+)')
+    ]
+
+    # Expresión regular para encontrar la id del hotel en el JSON embebido en los scripts de su página,
+    # e.g: "locationId":"233664" o location_id: 233664 (se formatea con la id del hotel)
+    location_id_regex = '["\']?(?:locationId|location_id|locId)["\']?\s*:\s*["\']?{}["\']?(?!\d)'
+
+    # Número de cada mes del año indexado por su nombre
+    months = dict(zip(['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+                       'september', 'october', 'november', 'december'], range(1, 13)))
+
 
     def __init__(self, **kwargs):
         '''
@@ -64,12 +105,49 @@ class TripAdvisorHotelSpider(Spider):
         config.override(Config(kwargs))
         config.check()
 
+        # Caché de geolocalizaciones de las direcciones de los hoteles
+        geocode_cache_path = config.get_path('GEOCODE_CACHE')
+        self.geocode_cache = GeocodeCache(geocode_cache_path) if config.is_true('SCRAP_GEO') and not geocode_cache_path is None else None
+
+        # Ids de los hoteles que esperan la geolocalización de una dirección (normalizada) que ya se ha
+        # solicitado a la API de Google Maps
+        self.pending_geocodes = {}
+
+        # Tareas pendientes (requests de deals, de geolocalización y de páginas de reviews) de cada
+        # hotel, indexadas por la id del hotel (ver start_hotel_task y finish_hotel_task)
+        self.hotel_tasks = {}
+
+        # Ids de los hoteles cuyas páginas ya se han solicitado (el mismo hotel puede aparecer en varias
+        # búsquedas o con distintas urls)
+        self.requested_hotels = set()
+
+        # En el modo incremental, se consulta la base de datos de ejecuciones anteriores para no volver a
+        # escrapear los hoteles actualizados recientemente ni las reviews ya almacenadas. La base de datos
+        # se abre en modo de solo lectura (el pipeline TripAdvisorPipelineDB es el que escribe en ella)
+        # Si aún no existe, no hay nada escrapeado anteriormente.
+        db_path = config.get_path('OUTPUT_SQLITE')
+        if config.is_true('INCREMENTAL_CRAWL') and not db_path is None and exists(db_path):
+            self.db = TripAdvisorDB(db_path, read_only = True)
+        else:
+            self.db = None
+
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         GlobalConfig().override(Config(crawler.settings))
         return cls(*args, **kwargs)
 
 
+    def closed(self, reason):
+        '''
+        Es invocado cuando la araña finaliza.
+        '''
+        if not self.geocode_cache is None:
+            self.log.debug('Geocode cache hits: {}, misses: {}'.format(self.geocode_cache.hits, self.geocode_cache.misses))
+            self.geocode_cache.close()
+        if not self.db is None:
+            self.db.close()
+
+
     def log_html_page(self, response):
         '''
         Permite depurar el código de esta clase, imprimiendo el DOM de la página obtenida como
@@ -107,33 +185,77 @@ class TripAdvisorHotelSpider(Spider):
         '''
         Parsea el resultado de una búsqueda en TripAdvisor. Por cada resultado (hotel encontrado)
         genera una nueva request.
+        Desde la primera página de resultados, se solicitan a la vez todas las demás páginas.
         '''
+        config = GlobalConfig()
+        terms = config.get_value('SEARCH_BY_TERMS')
+        max_results = config.get_value('MAX_SEARCH_RESULTS')
+        search_offset = response.meta['search_offset'] if 'search_offset' in response.meta else 0
+
+        self.log.debug('Parsing hotel search from offset {}'.format(search_offset))
+        result = response.css('div.info.poi-info div.title::attr(onclick)').re(self.search_result_onclick_regex)
+
+        if len(result) == 0:
+            if search_offset == 0:
+                raise ValueError('No hotel found with the search terms: {}'.format(terms))
+            return
+
+        for index, entry in enumerate(result):
+            # No se procesan más resultados que los indicados en MAX_SEARCH_RESULTS
+            if not max_results is None and search_offset + index >= max_results:
+                break
+
+            path, params = self.search_result_path_regex.match(entry).group(1, 3)
+
+            # Obtenemos la URL del hotel
+            self.log.debug('Search was succesful. Hotel info at {}'.format(TripAdvisorRequests.get_resource_url(path)))
+
+            # Parseamos información y reviews del hotel
+            request = self.request_hotel_page(path = path, params = params)
+            if not request is None:
+                yield request
+
+        # Parseamos las siguientes páginas de resultados (solo desde la primera página)
+        if search_offset > 0:
+            return
+
+        # El tamaño de página y el offset de la última página se obtienen de los atributos "data-offset" del
+        # panel de paginación (no del número de resultados extraídos, que es menor si alguno no se ha podido
+        # procesar)
+        page_size = self.get_search_page_size(response)
+        last_offset = response.css('div.pagination .pageNum.last::attr(data-offset)').extract_first()
+        if page_size is None or last_offset is None:
+            self.log.debug('Failed to get search results pagination from {}'.format(response.url))
+            return
+        num_results = int(last_offset) + page_size
+        if not max_results is None:
+            num_results = min(num_results, max_results)
+
+        self.log.debug('Processing search results pages from offset {} to {}'.format(page_size, num_results - 1))
+        for offset in range(page_size, num_results, page_size):
+            request = TripAdvisorRequests.search_hotels_by_terms(terms = terms, callback = self.parse_hotel_search_by_terms,
+                                                                 offset = offset)
+            request.meta['search_offset'] = offset
+            yield request
 
-        try:
-            self.log.debug('Parsing hotel search')
-            result = response.css('div.info.poi-info div.title::attr(onclick)')
-            if len(result) == 0:
-                raise ValueError()
-            result = result.re('\([ ]*\'[^\']*\'[ ]*,[ ]*\'[^\']*\'[ ]*,[ ]*\'[^\']*\'[ ]*,[ ]*[^\,]*[ ]*,[ ]*\'\/([^\']+)\'')
-
-            if len(result) == 0:
-                raise ValueError()
-
-            for entry in result:
-                path, params = match('^(.*)\?(.*)$', entry).groups()
-
-                # Obtenemos la URL del hotel
-                self.log.debug('Search was succesful. Hotel info at {}'.format(TripAdvisorRequests.get_resource_url(path)))
-
-                # Parseamos información y reviews del hotel
-                yield TripAdvisorRequests.get_hotel_page(path = path, params = params, callback = self.parse_hotel,
-                                                         fetch_deals = True)
 
-        except ValueError:
-            raise ValueError('No hotel found with the search terms: {}')
 
-        # Parseamos la siguiente página de resultados
-        # TODO
+    def get_search_page_size(self, response):
+        '''
+        Devuelve el número de resultados por página de una búsqueda por términos, a partir del panel de
+        paginación (e.g: la página 3 empieza en el offset 60 => 30 resultados por página)
+        :param response: Es la respuesta con una página de resultados de la búsqueda
+        :return: Devuelve el número de resultados por página o None si no hay panel de paginación.
+        '''
+        for page_selector in response.css('div.pagination .pageNum'):
+            page_number = page_selector.css('::attr(data-page-number)').extract_first()
+            offset = page_selector.css('::attr(data-offset)').extract_first()
+            if page_number is None or offset is None or int(page_number) <= 1:
+                continue
+            page_size = int(offset) // (int(page_number) - 1)
+            if page_size > 0:
+                return page_size
+        return None
 
 
 
@@ -146,7 +268,7 @@ class TripAdvisorHotelSpider(Spider):
         '''
         current_page = response.meta['page'] if 'page' in response.meta else 1
         next_page = current_page + 1
-        num_pages = response.meta['num_pages'] if 'num_pages' in response.meta else response.css('div.pagination .pageNum.last::attr(data-page-number)')
+        num_pages = response.meta['num_pages'] if 'num_pages' in response.meta else response.css('div.pagination .pageNum.last::attr(data-page-number)').extract_first()
 
         # Obtenemos todos los hoteles
         hotels = response.css('div.meta_listing div.listing_title a::attr(href)').re('^\/(.*)$')
@@ -155,9 +277,23 @@ class TripAdvisorHotelSpider(Spider):
 
 
         for hotel in hotels:
-            yield TripAdvisorRequests.get_hotel_page(path = hotel, callback = self.parse_hotel, fetch_deals = True)
-
-        # Procesar la siguiente página de búsqueda.
+            request = self.request_hotel_page(path = hotel)
+            if not request is None:
+                yield request
+
+        # Las páginas de resultados se solicitaron todas a la vez desde la primera página.
+        if 'search_page_url_template' in response.meta:
+            return
+
+        # Desde la primera página, se solicitan todas las demás páginas de resultados a la vez.
+        if current_page == 1:
+            requests = list(self.request_all_search_result_pages_by_place(response, num_pages))
+            if len(requests) > 0:
+                for request in requests:
+                    yield request
+                return
+
+        # Procesar la siguiente página de búsqueda (clickeando en el panel de paginación con Splash)
         if len(response.css('div.pagination a.next').extract()) > 0:
             request = TripAdvisorRequests.request_hotels_from_search_results_by_place(url = response.url, callback = self.parse_hotel_search_by_place, page_number = next_page)
             request.meta['page'] = next_page
@@ -165,6 +301,51 @@ class TripAdvisorHotelSpider(Spider):
             yield request
 
 
+    def request_all_search_result_pages_by_place(self, response, num_pages):
+        '''
+        Genera las requests de todas las páginas de resultados de una búsqueda de hoteles por
+        localización (excepto la primera).
+        Las urls de las páginas se construyen a partir de los enlaces del panel de paginación
+        (e.g: /Hotels-g187520-oa30-Pamplona_Navarra-Hotels.html) por lo que no es necesario usar Splash
+        Si no pueden construirse, no se genera ninguna request.
+        :param response: Es la respuesta con la primera página de resultados de la búsqueda
+        :param num_pages: Es el número de la última página de resultados
+        :return:
+        '''
+        if num_pages is None:
+            return
+        num_pages = int(num_pages)
+
+        # Obtenemos la plantilla de las urls y el número de resultados por página.
+        url_template, page_size = None, None
+        for page_selector in response.css('div.pagination a.pageNum'):
+            page_number = page_selector.css('::attr(data-page-number)').extract_first()
+            page_url = page_selector.css('::attr(href)').extract_first()
+            if page_number is None or page_url is None or int(page_number) <= 1:
+                continue
+            result = self.search_page_url_regex.match(page_url)
+            if result is None:
+                continue
+            prefix, offset, suffix = result.groups()
+            url_template = TripAdvisorRequests.get_resource_url('{}oa{{offset}}{}'.format(prefix, suffix))
+            page_size = int(offset) // (int(page_number) - 1)
+            break
+
+        if url_template is None or page_size == 0:
+            self.log.debug('Failed to get search results page url template from {}'.format(response.url))
+            return
+
+        self.log.debug('Processing {} search results pages'.format(num_pages - 1))
+        for page_number in range(2, num_pages + 1):
+            request = TripAdvisorRequests.request(url = url_template.format(offset = page_size * (page_number - 1)),
+                                                  callback = self.parse_hotel_search_by_place)
+            request.meta['page'] = page_number
+            request.meta['num_pages'] = num_pages
+            request.meta['search_page_url_template'] = url_template
+            request.meta['render_cache_type'] = 'search'
+            yield request
+
+
 
     def parse_hotel(self, response):
         '''
@@ -175,21 +356,183 @@ class TripAdvisorHotelSpider(Spider):
         '''
         config = GlobalConfig()
 
+        # La id del hotel se calcula una única vez y se comparte entre todos los parsers
+        hotel_id = self.get_hotel_id(response)
+
+        # La propia página del hotel es una tarea más, que termina después de procesarla entera.
+        self.start_hotel_task(hotel_id, 'page')
+
         methods = []
-        methods.append(self.parse_hotel_info(response))
+        methods.append(self.parse_hotel_info(response, hotel_id))
         if config.is_true('SCRAP_DEALS'):
-            methods.append(self.parse_hotel_deals(response))
+            if 'splash' in response.meta or self.hotel_deals_available(response):
+                methods.append(self.parse_hotel_deals(response, hotel_id))
+            else:
+                # Las deals no están en el HTML estático. Se renderiza la página con Splash solo para obtenerlas.
+                self.log.debug('Hotel deals not available in {}. Rendering it with Splash'.format(response.url))
+                request = TripAdvisorRequests.get_hotel_page(url = response.url, callback = self.parse_hotel_deals_page,
+                                                             errback = self.parse_hotel_task_error,
+                                                             fetch_deals = True, dont_filter = True)
+                request.meta['hotel_id'] = hotel_id
+                request.meta['hotel_task'] = 'deals'
+                self.start_hotel_task(hotel_id, 'deals')
+                methods.append([request])
         if config.is_true('SCRAP_REVIEWS'):
-            methods.append(self.parse_hotel_reviews(response))
+            methods.append(self.parse_hotel_reviews(response, hotel_id))
+
+        return self.run_hotel_task(hotel_id, 'page', chain(*methods))
+
+
+    def start_hotel_task(self, hotel_id, task):
+        '''
+        Registra una tarea pendiente de un hotel (e.g: una request a una de sus páginas de reviews)
+        :param hotel_id: Es la id del hotel
+        :param task: Es el nombre de la tarea
+        '''
+        self.hotel_tasks.setdefault(hotel_id, set()).add(task)
+
+
+    def finish_hotel_task(self, hotel_id, task):
+        '''
+        Indica que una tarea de un hotel ha terminado. Si era la última tarea pendiente del hotel,
+        se genera un item TripAdvisorHotelCompleted, para indicar que todos los datos del hotel ya
+        se han escrapeado (ver TripAdvisorPipelineBulkJSON)
+        Debe invocarse después de generar todos los items y requests de la tarea.
+        :param hotel_id: Es la id del hotel
+        :param task: Es el nombre de la tarea
+        :return:
+        '''
+        tasks = self.hotel_tasks.get(hotel_id)
+        if tasks is None:
+            return
+        tasks.discard(task)
+        if len(tasks) == 0:
+            del self.hotel_tasks[hotel_id]
+            yield TripAdvisorHotelCompleted(hotel_id = hotel_id)
+
+
+    def run_hotel_task(self, hotel_id, task, results):
+        '''
+        Genera los items y requests de una tarea de un hotel y después da por terminada la tarea.
+        La tarea termina aunque el parser genere una excepción (la excepción se propaga después), para
+        que el hotel no se quede incompleto.
+        :param hotel_id: Es la id del hotel
+        :param task: Es el nombre de la tarea
+        :param results: Es un iterable con los items y requests generados por el parser de la tarea.
+        :return:
+        '''
+        try:
+            for result in results:
+                yield result
+        except Exception:
+            for item in self.finish_hotel_task(hotel_id, task):
+                yield item
+            raise
+        for item in self.finish_hotel_task(hotel_id, task):
+            yield item
+
+
+    def parse_hotel_task_error(self, failure):
+        '''
+        Es invocado cuando falla una request de una de las tareas de un hotel (deals o páginas
+        de reviews). La tarea se da por terminada.
+        :param failure:
+        :return:
+        '''
+        request = failure.request
+        self.log.debug('Request to {} failed: {}'.format(request.url, str(failure.value)))
+        return self.finish_hotel_task(request.meta['hotel_id'], request.meta['hotel_task'])
+
+
+    def request_hotel_page(self, **kwargs):
+        '''
+        Instancia una request a la página de un hotel que será procesada por el método parse_hotel.
+        Si la variable de configuración "RENDER_HOTEL_PAGES_ON_DEMAND" está activa, la página se obtiene
+        sin Splash (la información y las reviews del hotel están en el HTML estático), y solo se renderiza
+        con Splash después si no contiene las deals del hotel.
+        :param kwargs: Son los parámetros de la request (ver TripAdvisorRequests.get_hotel_page)
+        :return: Devuelve la request o None si ya se ha solicitado la página del hotel o si el hotel se ha
+        escrapeado recientemente (en el modo incremental)
+        '''
+        config = GlobalConfig()
+        fetch_deals = config.is_true('SCRAP_DEALS') and not config.is_true('RENDER_HOTEL_PAGES_ON_DEMAND')
+        request = TripAdvisorRequests.get_hotel_page(callback = self.parse_hotel, fetch_deals = fetch_deals, **kwargs)
+
+        hotel_id = self.get_hotel_id_from_url(request.url)
+        if hotel_id in self.requested_hotels:
+            self.log.debug('Skipping hotel at {}. It was already requested'.format(request.url))
+            return None
+        self.requested_hotels.add(hotel_id)
+
+        if self.hotel_is_fresh(hotel_id):
+            self.log.debug('Skipping hotel at {}. It was scraped recently'.format(request.url))
+            return None
+        request.meta['hotel_id'] = hotel_id
+        return request
+
+
+    def hotel_is_fresh(self, hotel_id):
+        '''
+        Comprueba si un hotel se ha escrapeado en una ejecución anterior hace menos de
+        "HOTEL_FRESHNESS_WINDOW" segundos (solo en el modo incremental)
+        :param hotel_id:
+        :return:
+        '''
+        if self.db is None:
+            return False
+        scraped_at = self.db.get_hotel_scraped_at(hotel_id)
+        return not scraped_at is None and time() - scraped_at < GlobalConfig().get_value('HOTEL_FRESHNESS_WINDOW', 0)
+
+
+    def hotel_deals_available(self, response):
+        '''
+        Comprueba si la página de un hotel contiene sus deals (si no, es necesario renderizarla con Splash)
+        :param response:
+        :return:
+        '''
+        return len(response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links div.offer')) > 0
+
+
+    def get_hotel_id(self, response):
+        '''
+        Devuelve la id del hotel cuya página es la respuesta indicada como parámetro. Si la request
+        lleva la id del hotel en sus metadatos, se devuelve esta.
+        :param response:
+        :return:
+        '''
+        if 'hotel_id' in response.meta:
+            return response.meta['hotel_id']
+        return self.get_hotel_id_from_url(response.url)
 
-        return chain(*methods)
 
+    def get_hotel_id_from_url(self, url):
+        '''
+        Devuelve la id del hotel cuya página está en la url indicada. La id se construye con la id de la
+        localización y la id del hotel en TripAdvisor, de manera que es la misma para todas las urls del
+        hotel (e.g: "g187520-d233664")
+        Si la url no tiene este formato, la id es el hash de la url (sin sus parámetros)
+        :param url:
+        :return:
+        '''
+        result = self.hotel_url_regex.search(url)
+        if not result is None:
+            return 'g{}-d{}'.format(*result.groups())
+
+        hasher = sha256()
+        hasher.update(url.split('?')[0].encode())
+        return hasher.hexdigest()
 
-    def parse_hotel_info(self, response):
+
+    def parse_hotel_info(self, response, hotel_id = None):
         '''
         Parsea la información de un hotel en TripAdvisor
+        :param response:
+        :param hotel_id: Es la id del hotel. Si no se indica, se calcula a partir de la respuesta
         :return:
         '''
+        if hotel_id is None:
+            hotel_id = self.get_hotel_id(response)
+
         loader = ItemLoader(item=TripAdvisorHotelInfo(), response=response)
 
         loader.add_css('name', '#HEADING::text')
@@ -200,9 +543,7 @@ class TripAdvisorHotelSpider(Spider):
         loader.add_css('address', 'div.address span.locality::text', re = '^[ ]*(.+),[ ]*$')
         loader.add_css('address', 'div.address span.country-name::text', re = '^[ ]*(.+)[ ]*$')
 
-        hasher = sha256()
-        hasher.update(response.url.encode())
-        loader.add_value('id', hasher.hexdigest())
+        loader.add_value('id', hotel_id)
 
         item = loader.load_item()
 
@@ -210,118 +551,382 @@ class TripAdvisorHotelSpider(Spider):
 
         yield item
 
-        geo_request = GMapRequests.search_place(address = item.get('address'), callback = self.parse_hotel_geolocation)
-        geo_request.meta['hotel_id'] = item.get('id')
-
         if GlobalConfig().is_true('SCRAP_GEO'):
-            yield geo_request
+            location = self.extract_hotel_coordinates(response)
+            if not location is None:
+                latitude, longitude = location
+                yield self.get_hotel_geolocation_item(item.get('id'), latitude, longitude)
+            elif GlobalConfig().is_set('GOOGLE_MAPS_API_KEY'):
+                for geo_item in self.geolocate_hotel(item.get('id'), item.get('address')):
+                    yield geo_item
+            else:
+                self.log.debug('No coordinates found for "{}" hotel'.format(item.get('name')))
+
+
+    def extract_hotel_coordinates(self, response):
+        '''
+        Extrae las coordenadas de un hotel de su página en TripAdvisor. La página también tiene las
+        coordenadas de otros hoteles (e.g: en el mapa de hoteles cercanos), así que solo se aceptan las
+        que están ligadas al propio hotel. Se buscan, por orden:
+        - En los datos estructurados (JSON-LD) del hotel, cuya url debe ser la del hotel.
+        - En los atributos del contenedor del mapa del hotel o de los elementos con la id del hotel.
+        - En las etiquetas meta de la página.
+        - En los objetos del JSON embebido en los scripts que tienen la id del hotel.
+        :param response:
+        :return: Devuelve una tupla (latitud, longitud) o None si no se encuentran coordenadas válidas
+        '''
+        # Id del hotel en TripAdvisor (e.g: "233664" en /Hotel_Review-g187520-d233664-Reviews-...)
+        result = self.hotel_url_regex.search(response.url)
+        location_id = result.group(2) if not result is None else None
+
+        candidates = []
+        for script in response.xpath('//script[@type="application/ld+json"]/text()').extract():
+            candidates.extend(self.extract_hotel_coordinates_from_json_ld(script, location_id))
+
+        for map_selector in response.css('[data-lat][data-lng]'):
+            # Se aceptan el contenedor del mapa del hotel y los elementos con la id del hotel.
+            map_location_id = map_selector.css('::attr(data-locid)').extract_first()
+            map_classes = (map_selector.css('::attr(class)').extract_first() or '').split()
+            if map_location_id is None and not 'mapContainer' in map_classes:
+                continue
+            if not map_location_id is None and map_location_id != location_id:
+                continue
+            candidates.append((map_selector.css('::attr(data-lat)').extract_first(),
+                               map_selector.css('::attr(data-lng)').extract_first()))
+
+        candidates.append((response.css('meta[property="place:location:latitude"]::attr(content)').extract_first(),
+                           response.css('meta[property="place:location:longitude"]::attr(content)').extract_first()))
+
+        if not location_id is None:
+            location_id_regex = compile(self.location_id_regex.format(location_id))
+            for script in response.xpath('//script[not(@type="application/ld+json")]/text()').extract():
+                for result in location_id_regex.finditer(script):
+                    # Se buscan las coordenadas en el objeto que contiene la id del hotel.
+                    start, end = script.rfind('{', 0, result.start()), script.find('}', result.end())
+                    if start < 0 or end < 0:
+                        continue
+                    for regex in self.coordinates_regexes:
+                        candidates.extend(regex.findall(script[start:end]))
+
+        for latitude, longitude in candidates:
+            try:
+                latitude, longitude = float(latitude), float(longitude)
+            except (TypeError, ValueError):
+                continue
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180 and (latitude, longitude) != (0, 0):
+                return latitude, longitude
+        return None
+
+
+    def extract_hotel_coordinates_from_json_ld(self, script, location_id = None):
+        '''
+        Extrae las coordenadas de un hotel de sus datos estructurados (JSON-LD) e.g:
+        {"@type": "Hotel", "url": "/Hotel_Review-g187520-d233664-...", "geo": {"latitude": 42.81, "longitude": -1.64}}
+        :param script: Es el contenido del script con los datos estructurados.
+        :param location_id: Es la id del hotel en TripAdvisor. Si se indica, solo se aceptan los datos
+        cuya url es la del hotel.
+        :return: Devuelve un listado de tuplas (latitud, longitud)
+        '''
+        try:
+            data = json.loads(script)
+        except ValueError:
+            return []
+
+        entities = data if isinstance(data, list) else [data]
+        entities = list(chain(*[entity.get('@graph', [entity]) for entity in entities if isinstance(entity, dict)]))
+
+        coordinates = []
+        for entity in entities:
+            if not isinstance(entity, dict) or not isinstance(entity.get('geo'), dict):
+                continue
+            if not location_id is None:
+                result = self.hotel_url_regex.search(str(entity.get('url', '')))
+                if result is None or result.group(2) != location_id:
+                    continue
+            coordinates.append((entity['geo'].get('latitude'), entity['geo'].get('longitude')))
+        return coordinates
+
+
+    def geolocate_hotel(self, hotel_id, address):
+        '''
+        Obtiene la geolocalización de un hotel a partir de su dirección. Si la dirección está en la caché
+        de geolocalizaciones, se genera directamente el item con la geolocalización del hotel. En caso
+        contrario, se genera una request a la API de Google Maps (solo una por cada dirección distinta)
+        :param hotel_id: Es la id del hotel
+        :param address: Es la dirección del hotel
+        :return:
+        '''
+        address_key = normalize_address(address)
+
+        if not self.geocode_cache is None:
+            location = self.geocode_cache.get(address_key)
+            if not location is None:
+                latitude, longitude = location
+                yield self.get_hotel_geolocation_item(hotel_id, latitude, longitude)
+                return
+
+        self.start_hotel_task(hotel_id, 'geo')
 
+        # Si ya se ha solicitado la geolocalización de la misma dirección, se espera a su respuesta.
+        if address_key in self.pending_geocodes:
+            self.pending_geocodes[address_key].append(hotel_id)
+            return
+        self.pending_geocodes[address_key] = [hotel_id]
 
-    def parse_hotel_deals(self, response):
+        geo_request = GMapRequests.search_place(address = address, callback = self.parse_hotel_geolocation,
+                                                errback = self.parse_hotel_geolocation_error)
+        geo_request.meta['hotel_id'] = hotel_id
+        geo_request.meta['geocode_address'] = address_key
+        yield geo_request
+
+
+    def parse_hotel_deals(self, response, hotel_id = None):
         '''
         Procesa la información de las "deals" de un hotel en TripAdvisor.
         :param response:
+        :param hotel_id: Es la id del hotel. Si no se indica, se calcula a partir de la respuesta
         :return:
         '''
-        hasher = sha256()
-        hasher.update(response.url.encode())
-        hotel_id = hasher.hexdigest()
-
-        num_deals = len(response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links').xpath('.//div[contains(@class, "offer") and contains(@class, "textLink") and not(contains(@class, "unclickable"))]'))
-        for i in range(0, num_deals):
+        if hotel_id is None:
+            hotel_id = self.get_hotel_id(response)
+
+        # Procesamos las deals recorriendo una única vez los elementos de las ofertas
+        num_deals = 0
+        deal_selectors = response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links')\
+            .xpath('.//div[contains(@class, "offer") and contains(@class, "textLink") and not(contains(@class, "unclickable"))]')
+        for deal_selector in deal_selectors:
             try:
-                deal_selector = response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links')
-                deal_selector = deal_selector.xpath(
-                    './/div[contains(@class, "offer") and contains(@class, "textLink") and not(contains(@class, "unclickable"))][{}]'.format(i + 1))
-
                 loader = ItemLoader(item = TripAdvisorHotelDeals(), selector = deal_selector)
                 loader.add_css('provider_name', 'span.providerName::attr(title)')
                 loader.add_css('price', 'span.price::attr(title)', re = '(\d+)')
                 loader.add_value('hotel_id', hotel_id)
 
                 item = loader.load_item()
+                num_deals += 1
                 yield item
 
-            except:
-                pass
+            except Exception as e:
+                self.log.debug('Failed to extract deal from hotel info: {}'.format(str(e)))
+
         if num_deals > 0:
             self.log.debug('Succesfully extracted {} deals from hotel info'.format(num_deals))
 
 
-    def parse_hotel_reviews(self, response):
+    def parse_hotel_reviews(self, response, hotel_id = None):
         '''
         Parsea las reviews de un hotel.
         :param response:
+        :param hotel_id: Es la id del hotel. Si no se indica, se obtiene de los metadatos de la
+        request o se calcula a partir de la respuesta
         :return:
         '''
-        if not 'hotel_id' in response.meta:
-            hasher = sha256()
-            hasher.update(response.url.encode())
-            hasher.hexdigest()
-            hotel_id = hasher.hexdigest()
-        else:
-            hotel_id = response.meta['hotel_id']
+        if hotel_id is None:
+            hotel_id = self.get_hotel_id(response)
 
-        #review_offset = int(response.css('div.listContainer p.pagination-details').xpath('.//b[1]//text()').extract_first()) - 1
-        num_reviews = len(response.css('div.listContainer div.review-container').extract())
         review_offset = response.meta['review_offset'] if 'review_offset' in response.meta else 0
 
-
-        # Procesamos las reviews de la página
-        for i in range(0, num_reviews):
+        # Procesamos las reviews de la página (se recorre el DOM una única vez)
+        num_reviews = 0
+        stored_review_found = False
+        for review_selector in response.css('div.listContainer div.review-container'):
+            num_reviews += 1
             try:
-                review_selector = response.css('div.listContainer')
-                review_selector = review_selector.xpath(
-                    './/div[contains(@class, "review-container")][{}]'.format(i+1))
-
-                loader = ItemLoader(item = TripAdvisorHotelReview(), selector = review_selector)
-                loader.add_css('title', 'span.noQuotes::text')
-                loader.add_css('text', 'div.prw_reviews_text_summary_hsx p.partial_entry::text')
-                loader.add_css('rating', 'span.ui_bubble_rating', re='class="[^\"]*bubble_(\d+)[^\"]*"')
-                loader.add_value('hotel_id', hotel_id)
+                item = self.parse_hotel_review(review_selector, hotel_id)
+            except Exception as e:
+                self.log.debug('Failed to extract review {} from offset {}: {}'.format(num_reviews, review_offset, str(e)))
+                continue
 
-                date = review_selector.css('span.ratingDate::attr(title)').extract_first()
-                result = match('^[ ]*([^ ]+)[ ]+(\d+)[ ]*\,[ ]*([^ ]+)[ ]*$', date)
-                month_str, day, year = result.groups()
-                month_str = month_str.lower()
-                month = dict(zip(['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
-                                  'september', 'october', 'november', 'december'], range(0, 12)))[month_str]
+            # En el modo incremental, las reviews que ya se almacenaron en ejecuciones anteriores se descartan
+            if not self.db is None and self.db.review_exists(hotel_id, item.get('title'), item.get('date'), item.get('tripadvisor_id')):
+                stored_review_found = True
+                continue
+            yield item
 
-                loader.add_value('date', datetime(year = int(year), month = month, day = int(day)).date().isoformat())
 
+        self.log.debug('Succesfully extracted {} reviews from offset {} to {}'.format(num_reviews, review_offset, review_offset + num_reviews - 1))
+
+        # Las reviews están ordenadas de más reciente a más antigua: si se ha encontrado una review ya
+        # almacenada, las de las siguientes páginas también lo están.
+        if stored_review_found:
+            self.log.debug('Found an already stored review at offset {}. Skipping the next review pages'.format(review_offset))
+            return
 
-                loader.load_item()
-                yield loader.item
-            except:
-                pass
+        # Procesamos las reviews de las siguientes páginas.
+        if 'review_url_template' in response.meta:
+            url_template = response.meta['review_url_template']
+        else:
+            url_template = self.get_review_page_url_template(response.url)
+            if url_template is None:
+                self.log.debug('Failed to get reviews page url template from {}'.format(response.url))
+                return
 
+        config = GlobalConfig()
+        max_review_pages = config.get_value('MAX_REVIEW_PAGES')
 
-        self.log.debug('Succesfully extracted {} reviews from offset {} to {}'.format(num_reviews, review_offset, review_offset + num_reviews - 1))
+        # Desde la primera página se generan las requests de todas las demás de forma simultánea. En el modo
+        # incremental, las páginas de los hoteles ya almacenados se solicitan de una en una, para detenerse
+        # en la primera review ya almacenada. La decisión se toma en la primera página y se propaga al resto.
+        if 'review_fan_out' in response.meta:
+            fan_out = response.meta['review_fan_out']
+        else:
+            fan_out = config.is_true('REVIEWS_PAGINATION_FAN_OUT') and (self.db is None or not self.db.hotel_exists(hotel_id))
+
+        if fan_out:
+            if not 'review_offset' in response.meta:
+                for request in self.request_all_hotel_review_pages(response, hotel_id, url_template, num_reviews, max_review_pages):
+                    request.meta['review_fan_out'] = True
+                    yield request
+            return
+
+        review_page = response.meta['review_page'] if 'review_page' in response.meta else 1
+        next_review_offset = response.css('div.pagination span.next::attr(data-offset)').extract_first()
+        if next_review_offset is None:
+            # Las reviews del hotel caben en una única página (no hay panel de paginación)
+            self.log.debug('All reviews have been extracted. Last review offset was: {}'.format(review_offset + num_reviews - 1))
+            return
 
-        # Procesamos las reviews de la siguiente página.
-        next_review_offset = int(response.css('div.pagination span.next::attr(data-offset)').extract_first())
-        if (next_review_offset - review_offset) == num_reviews and len(response.css('div.pagination').xpath('.//span[contains(@class, "next") and not(contains(@class, "disabled"))]')) > 0:
+        next_review_offset = int(next_review_offset)
+        if (next_review_offset - review_offset) == num_reviews and\
+                len(response.css('div.pagination').xpath('.//span[contains(@class, "next") and not(contains(@class, "disabled"))]')) > 0 and\
+                (max_review_pages is None or review_page < max_review_pages):
             self.log.debug('Processing next review\'s section page, with offset = {}'.format(next_review_offset))
 
-            url_match_result = match(('^(.*\/{})(or\d+\-)?(.*)$'.format('{0}' * 4)).format('[^-]+\-'), response.url)
-            url = url_match_result.group(1) + url_match_result.group(3)
-            next_page_url = '{}{}{}'.format(url_match_result.group(1),
-                                            'or{}-'.format(next_review_offset),
-                                            url_match_result.group(3))
-            self.log.debug('Next reviews page in {}'.format(next_page_url))
-            result = match('^https?\:\/\/[^\/]+\/([^\?]+)(\?(.*))?$', next_page_url)
-            path = result.group(1)
-            params = result.group(3)
-
             # Realizamos la request a la siguiente página.
-            request = TripAdvisorRequests.get_hotel_page(path = path, params = params, callback = self.parse_hotel_reviews)
-            request.meta['hotel_id'] = hotel_id
-            request.meta['review_offset'] = next_review_offset
+            request = self.request_hotel_review_page(url_template, next_review_offset, hotel_id)
+            request.meta['review_page'] = review_page + 1
+            request.meta['review_fan_out'] = False
             yield request
         else:
             self.log.debug('All reviews have been extracted. Last review offset was: {}'.format(review_offset + num_reviews - 1))
 
 
+    def get_review_page_url_template(self, url):
+        '''
+        Construye una plantilla para generar las urls de las páginas de reviews de un hotel a partir de
+        la url de cualquiera de ellas.
+        e.g:
+        https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html
+        => https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews-or{offset}-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html
+        :param url: Es la url de una página de reviews del hotel
+        :return: Devuelve la plantilla (debe formatearse con el parámetro "offset") o None si la
+        url no es válida
+        '''
+        result = self.review_page_url_regex.match(url)
+        if result is None:
+            return None
+        prefix, offset, suffix = result.groups()
+        escape = lambda part: part.replace('{', '{{').replace('}', '}}')
+        return '{}or{{offset}}-{}'.format(escape(prefix), escape(suffix))
+
+
+    def request_hotel_review_page(self, url_template, review_offset, hotel_id):
+        '''
+        Instancia una request a la página de reviews de un hotel que comienza en el offset indicado.
+        :param url_template: Es la plantilla de urls de las páginas de reviews del hotel
+        (ver get_review_page_url_template)
+        :param review_offset: Es el offset de la primera review de la página
+        :param hotel_id: Es la id del hotel
+        :return:
+        '''
+        url = url_template.format(offset = review_offset)
+        self.log.debug('Reviews page in {}'.format(url))
+
+        request = TripAdvisorRequests.get_hotel_page(url = url, callback = self.parse_hotel_review_page,
+                                                     errback = self.parse_hotel_task_error)
+        request.meta['hotel_id'] = hotel_id
+        request.meta['review_offset'] = review_offset
+        request.meta['review_url_template'] = url_template
+        request.meta['render_cache_type'] = 'reviews'
+        request.meta['hotel_task'] = 'reviews:{}'.format(review_offset)
+        self.start_hotel_task(hotel_id, request.meta['hotel_task'])
+        return request
+
+
+    def parse_hotel_review_page(self, response):
+        '''
+        Parsea una página de reviews de un hotel (ver parse_hotel_reviews) y da por terminada su tarea.
+        :param response:
+        :return:
+        '''
+        return self.run_hotel_task(response.meta['hotel_id'], response.meta['hotel_task'],
+                                   self.parse_hotel_reviews(response))
+
+
+    def parse_hotel_deals_page(self, response):
+        '''
+        Parsea las deals de la página de un hotel renderizada con Splash (ver parse_hotel_deals) y da
+        por terminada su tarea.
+        :param response:
+        :return:
+        '''
+        return self.run_hotel_task(response.meta['hotel_id'], response.meta['hotel_task'],
+                                   self.parse_hotel_deals(response))
+
+
+    def request_all_hotel_review_pages(self, response, hotel_id, url_template, page_size, max_review_pages = None):
+        '''
+        Genera las requests de todas las páginas de reviews de un hotel (excepto la primera) a partir
+        de la primera página de reviews. El número total de reviews se obtiene del panel de paginación
+        o de la cabecera de las reviews.
+        :param response: Es la respuesta con la primera página de reviews del hotel
+        :param hotel_id: Es la id del hotel
+        :param url_template: Es la plantilla de urls de las páginas de reviews del hotel
+        :param page_size: Es el número de reviews de la primera página.
+        :param max_review_pages: Si se indica, es el número máximo de páginas de reviews a procesar
+        (incluyendo la primera)
+        :return:
+        '''
+        next_review_offset = response.css('div.pagination span.next::attr(data-offset)').extract_first()
+        if not next_review_offset is None:
+            page_size = int(next_review_offset)
+        if page_size == 0:
+            return
+
+        last_review_offset = response.css('div.pagination .pageNum.last::attr(data-offset)').extract_first()
+        if not last_review_offset is None:
+            num_reviews = int(last_review_offset) + 1
+        else:
+            num_reviews = response.css('span.reviews_header_count::text').re_first('(\d[\d,]*)')
+            if num_reviews is None:
+                self.log.debug('Failed to get the number of reviews of the hotel from {}'.format(response.url))
+                return
+            num_reviews = int(num_reviews.replace(',', ''))
+
+        review_offsets = range(page_size, num_reviews, page_size)
+        if not max_review_pages is None:
+            review_offsets = review_offsets[:max(max_review_pages - 1, 0)]
+
+        self.log.debug('Processing {} review\'s section pages of {} reviews'.format(len(review_offsets), num_reviews))
+        for review_offset in review_offsets:
+            yield self.request_hotel_review_page(url_template, review_offset, hotel_id)
+
+
+    def parse_hotel_review(self, review_selector, hotel_id):
+        '''
+        Extrae una review de un hotel.
+        :param review_selector: Es el selector del elemento "div.review-container" de la review
+        :param hotel_id: Es la id del hotel al que pertenece la review
+        :return: Devuelve una instancia de la clase TripAdvisorHotelReview. Genera una excepción
+        si la review no puede extraerse.
+        '''
+        loader = ItemLoader(item = TripAdvisorHotelReview(), selector = review_selector)
+        # La id de la review en TripAdvisor está en el atributo "data-reviewid" o en el atributo "id"
+        # (e.g: id="review_541234567") del contenedor de la review o de alguno de sus elementos.
+        loader.add_xpath('tripadvisor_id', './@data-reviewid | .//*[@data-reviewid]/@data-reviewid', re = '^(\d+)$')
+        loader.add_xpath('tripadvisor_id', './@id | .//*[@id]/@id', re = '^review_(\d+)$')
+        loader.add_css('title', 'span.noQuotes::text')
+        loader.add_css('text', 'div.prw_reviews_text_summary_hsx p.partial_entry::text')
+        loader.add_css('rating', 'span.ui_bubble_rating', re='class="[^\"]*bubble_(\d+)[^\"]*"')
+        loader.add_value('hotel_id', hotel_id)
+
+        date = review_selector.css('span.ratingDate::attr(title)').extract_first()
+        month_str, day, year = self.review_date_regex.match(date).groups()
+        month = self.months[month_str.lower()]
+        loader.add_value('date', datetime(year = int(year), month = month, day = int(day)).date().isoformat())
+
+        return loader.load_item()
+
+
     def parse_hotel_geolocation(self, response):
         '''
         Este método parsea la geolocalización de un hotel de TripAdvisor
@@ -331,13 +936,56 @@ class TripAdvisorHotelSpider(Spider):
         '''
         self.log.debug('Parsing hotel gelocation using Google Maps API: {}'.format(response.url))
 
-        data = json.loads(response.text)['results'][0]
+        address_key = response.meta.get('geocode_address')
+        hotel_ids = self.pending_geocodes.pop(address_key, [response.meta['hotel_id']])
+
+        # La API responde con código 200 aunque no encuentre la dirección (status "ZERO_RESULTS") o se
+        # supere la cuota (status "OVER_QUERY_LIMIT"). En ese caso, los hoteles se quedan sin geolocalización.
+        location = None
+        try:
+            data = json.loads(response.text)
+            if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
+                location = data['results'][0]['geometry']['location']['lat'], data['results'][0]['geometry']['location']['lng']
+            else:
+                self.log.debug('Failed to get hotel geolocation from {}: status is {}'.format(response.url, data.get('status')))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.log.debug('Failed to parse hotel geolocation from {}: {}'.format(response.url, str(e)))
+
+        if not location is None and not self.geocode_cache is None and not address_key is None:
+            self.geocode_cache.put(address_key, *location)
+
+        for hotel_id in hotel_ids:
+            if not location is None:
+                yield self.get_hotel_geolocation_item(hotel_id, *location)
+            for item in self.finish_hotel_task(hotel_id, 'geo'):
+                yield item
+
 
-        loader = ItemLoader(item = TripAdvisorHotelGeolocation(), response = response)
-        loader.add_value('latitude', data['geometry']['location']['lat'])
-        loader.add_value('longitude', data['geometry']['location']['lng'])
-        loader.add_value('hotel_id', response.meta['hotel_id'])
+    def parse_hotel_geolocation_error(self, failure):
+        '''
+        Es invocado cuando falla una request a la API de Google Maps para geolocalizar un hotel.
+        :param failure:
+        :return:
+        '''
+        request = failure.request
+        if request.meta.get('geocode_lane_retried'):
+            # La request se reintentará (ver middlewares.GeocodeLane)
+            return
+        self.log.debug('Failed to get hotel geolocation from {}: {}'.format(request.url, str(failure.value)))
+        hotel_ids = self.pending_geocodes.pop(request.meta.get('geocode_address'), [request.meta['hotel_id']])
+        for hotel_id in hotel_ids:
+            for item in self.finish_hotel_task(hotel_id, 'geo'):
+                yield item
 
-        item = loader.load_item()
 
-        yield item
+    def get_hotel_geolocation_item(self, hotel_id, latitude, longitude):
+        '''
+        Construye el item con la geolocalización de un hotel.
+        :return: Devuelve una instancia de la clase TripAdvisorHotelGeolocation
+        '''
+        loader = ItemLoader(item = TripAdvisorHotelGeolocation())
+        loader.add_value('latitude', latitude)
+        loader.add_value('longitude', longitude)
+        loader.add_value('hotel_id', hotel_id)
+
+        return loader.load_item()
@@ -1,4 +1,3 @@
-
 /**
 Si esta activado el sandboxing y la página web a scrapear está embebida en un iframe,
 redefinimos $...
@@ -8,53 +7,98 @@ callback_wrapper = function(callback) {
     this.callback = callback;
 }
 
+/**
+Intervalo (en milisegundos) con el que se comprueban las condiciones cuando el navegador no
+soporta MutationObserver o cuando los cambios no generan mutaciones en el DOM (por ejemplo, el
+valor de un input).
+*/
+callback_wrapper.fallbackCheckInterval = 250;
+
+/**
+Ejecuta el callback cuando la condición indicada se cumpla. La condición se comprueba cada vez
+que el DOM de la página cambia (usando MutationObserver), en vez de hacerlo periódicamente.
+Si MutationObserver no está disponible, la condición se comprueba periódicamente.
+*/
 callback_wrapper.prototype.executeWhen = function(condition) {
-    if(condition())
+    if(condition()) {
         this.callback();
-    else
-    {
-        var wrapper = this;
-        var checkInterval = 10
-        var interval = setInterval(function() {
-            if(condition()) {
-                clearInterval(interval);
-                wrapper.callback();
-            }
-        }, checkInterval);
+        return;
     }
+
+    var wrapper = this;
+    var observer = null;
+    var interval = null;
+    var done = false;
+
+    var check = function() {
+        if(done || !condition())
+            return;
+        done = true;
+        if(observer !== null)
+            observer.disconnect();
+        if(interval !== null)
+            clearInterval(interval);
+        wrapper.callback();
+    };
+
+    var MutationObserverClass = window.MutationObserver || window.WebKitMutationObserver;
+    if(MutationObserverClass) {
+        observer = new MutationObserverClass(check);
+        observer.observe(document.documentElement, {
+            childList: true,
+            subtree: true,
+            attributes: true,
+            characterData: true
+        });
+    }
+    else {
+        interval = setInterval(check, callback_wrapper.fallbackCheckInterval);
+    }
+    return check;
 }
 
 callback_wrapper.prototype.executeWhenElementAvaliable = function(selector) {
-    this.executeWhen(function() {
-        return $(selector).length > 0;
-    });
+    this.executeWhenAllElementsAvaliable([selector]);
 }
 
 
+/**
+Todos los selectores se comprueban a la vez en cada cambio del DOM.
+*/
 callback_wrapper.prototype.executeWhenAllElementsAvaliable = function(selectors) {
-    if(selectors.length == 0) {
-        this.callback();
-    }
-    else if(selectors.length == 1) {
-        this.executeWhenElementAvaliable(selectors[0]);
-    }
-    else
-    {
-        var selectors = selectors.slice();
-        var selector = selectors.pop();
-
-        var wrapper = this;
-        var another_wrapper = new callback_wrapper(function() {
-            wrapper.executeWhenElementAvaliable(selector);
-        });
-        another_wrapper.executeWhenAllElementsAvaliable(selectors);
-    }
+    this.executeWhen(function() {
+        for(var i = 0; i < selectors.length; i++) {
+            if($(selectors[i]).length == 0)
+                return false;
+        }
+        return true;
+    });
 }
 
+/**
+El valor de un input no genera mutaciones en el DOM, así que además de observar el DOM, se
+escuchan los eventos "input" y "change" y se comprueba periódicamente como último recurso.
+*/
 callback_wrapper.prototype.executeWhenInputHasValue = function(selector, value) {
-    this.executeWhen(function() {
+    var condition = function() {
         return $(selector).val() === value;
-    });
+    };
+
+    var interval = null;
+    var wrapper = new callback_wrapper(this.callback);
+    var check = wrapper.executeWhen(condition);
+    if(check === undefined)
+        return;
+
+    var onChange = function() {
+        check();
+        if(condition()) {
+            clearInterval(interval);
+            $(document).off('input change', selector, onChange);
+        }
+    };
+    $(document).on('input change', selector, onChange);
+    interval = setInterval(onChange, callback_wrapper.fallbackCheckInterval);
 }
 
 
@@ -0,0 +1,170 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de los parsers de la araña TripAdvisorHotelSpider, sobre páginas de hoteles guardadas en
+tests/fixtures
+'''
+
+import unittest
+from os.path import dirname, join
+
+try:
+    from scrapy.http import HtmlResponse, Request
+    from TripAdvisorScraper.spiders.tripadvisor_hotel_spider import TripAdvisorHotelSpider
+    from TripAdvisorScraper.items import TripAdvisorHotelReview, TripAdvisorHotelDeals
+except ImportError:
+    TripAdvisorHotelSpider = None
+
+
+# Url de la página del hotel de las fixtures
+HOTEL_URL = 'https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html'
+
+
+def get_fixture_response(file_name, url = HOTEL_URL, meta = None):
+    '''
+    Construye una respuesta con el contenido de una de las páginas de tests/fixtures
+    :param file_name: Es el nombre del fichero de la página
+    :param url: Es la url de la página
+    :param meta: Son los metadatos de la request
+    :return:
+    '''
+    with open(join(dirname(__file__), 'fixtures', file_name), 'rb') as fh:
+        body = fh.read()
+    return HtmlResponse(url = url, body = body, encoding = 'utf-8', request = Request(url, meta = meta or {}))
+
+
+def get_spider():
+    return TripAdvisorHotelSpider(SEARCH_BY_TERMS = 'Hotel Blanca Navarra')
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorSearchByTermsTest(unittest.TestCase):
+    '''
+    Comprueba la paginación de las búsquedas por términos
+    '''
+    def setUp(self):
+        self.spider = get_spider()
+
+    def test_pages_are_requested_from_pagination_offsets(self):
+        response = get_fixture_response('search_by_terms_page.html', url = 'https://www.tripadvisor.com/Search?q=Hotel+Navarra')
+        requests = list(self.spider.parse_hotel_search_by_terms(response))
+
+        # Uno de los tres resultados no se puede procesar, pero el tamaño de página sigue siendo 3.
+        hotel_requests = [request for request in requests if not 'search_offset' in request.meta]
+        page_requests = [request for request in requests if 'search_offset' in request.meta]
+        self.assertEqual([request.meta['hotel_id'] for request in hotel_requests], ['g187520-d233664', 'g187520-d228530'])
+        self.assertEqual([request.meta['search_offset'] for request in page_requests], [3, 6, 9])
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorHotelReviewsTest(unittest.TestCase):
+    '''
+    Comprueba la extracción de las reviews de una página de un hotel
+    '''
+    def setUp(self):
+        self.spider = get_spider()
+
+    def test_review_date_regex(self):
+        result = TripAdvisorHotelSpider.review_date_regex.match(' October 18 , 2017 ')
+        self.assertEqual(result.groups(), ('October', '18', '2017'))
+        self.assertIsNone(TripAdvisorHotelSpider.review_date_regex.match('Reviewed 2 days ago'))
+
+    def test_months(self):
+        months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                  'September', 'October', 'November', 'December']
+        for number, month in enumerate(months, 1):
+            self.assertEqual(TripAdvisorHotelSpider.months[month.lower()], number)
+
+    def test_reviews_are_extracted_in_order(self):
+        response = get_fixture_response('hotel_page.html')
+        items = list(self.spider.parse_hotel_reviews(response, 'g187520-d233664'))
+
+        # La segunda review no tiene fecha: se descarta sin perder las demás. Tampoco hay panel
+        # de paginación, así que no se solicitan más páginas.
+        self.assertTrue(all(isinstance(item, TripAdvisorHotelReview) for item in items))
+        self.assertEqual([item['title'] for item in items], ['Great location', 'Excellent breakfast'])
+        self.assertEqual([item['date'] for item in items], ['2017-10-18', '2016-02-03'])
+        self.assertEqual([item['rating'] for item in items], [40, 50])
+        self.assertEqual([item['tripadvisor_id'] for item in items], [541234567, 541234569])
+        self.assertEqual([item['text'] for item in items], ['Close to the old town.', 'Friendly staff.'])
+        self.assertTrue(all(item['hotel_id'] == 'g187520-d233664' for item in items))
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorHotelDealsTest(unittest.TestCase):
+    '''
+    Comprueba la extracción de las deals de una página de un hotel
+    '''
+    def setUp(self):
+        self.spider = get_spider()
+
+    def test_deals_are_extracted_in_order(self):
+        response = get_fixture_response('hotel_page.html')
+        self.assertTrue(self.spider.hotel_deals_available(response))
+
+        # La oferta "unclickable" no se extrae.
+        items = list(self.spider.parse_hotel_deals(response, 'g187520-d233664'))
+        self.assertTrue(all(isinstance(item, TripAdvisorHotelDeals) for item in items))
+        self.assertEqual([(item['provider_name'], item['price']) for item in items], [('Booking.com', 85.0), ('Expedia', 102.0)])
+        self.assertTrue(all(item['hotel_id'] == 'g187520-d233664' for item in items))
+
+    def test_hotel_id_is_shared(self):
+        # La id del hotel es la misma para todas sus urls, y se toma de los metadatos de la request si está.
+        review_page_url = HOTEL_URL.replace('-Reviews-', '-Reviews-or5-')
+        self.assertEqual(self.spider.get_hotel_id_from_url(HOTEL_URL), 'g187520-d233664')
+        self.assertEqual(self.spider.get_hotel_id_from_url(review_page_url + '?lang=en'), 'g187520-d233664')
+
+        response = get_fixture_response('hotel_page.html', meta = {'hotel_id': 'shared-id'})
+        self.assertEqual(self.spider.get_hotel_id(response), 'shared-id')
+        items = list(self.spider.parse_hotel_deals(response))
+        self.assertTrue(len(items) > 0 and all(item['hotel_id'] == 'shared-id' for item in items))
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorHotelCoordinatesTest(unittest.TestCase):
+    '''
+    Comprueba que las coordenadas se extraen del propio hotel y no de otros elementos de su página
+    (hoteles cercanos, puntos de interés, anuncios, ...)
+    '''
+    def setUp(self):
+        self.spider = get_spider()
+
+    def extract_coordinates(self, file_name):
+        return self.spider.extract_hotel_coordinates(get_fixture_response(file_name))
+
+    def test_json_ld(self):
+        self.assertEqual(self.extract_coordinates('hotel_coordinates_json_ld.html'), (42.8125, -1.6458))
+
+    def test_map_container(self):
+        self.assertEqual(self.extract_coordinates('hotel_coordinates_map.html'), (42.8125, -1.6458))
+
+    def test_script(self):
+        self.assertEqual(self.extract_coordinates('hotel_coordinates_script.html'), (42.8125, -1.6458))
+
+    def test_other_hotels_are_ignored(self):
+        self.assertIsNone(self.extract_coordinates('hotel_coordinates_nearby_only.html'))
+        self.assertIsNone(self.extract_coordinates('hotel_page.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
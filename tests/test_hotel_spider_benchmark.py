@@ -0,0 +1,187 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Benchmarks de los parsers de la araña TripAdvisorHotelSpider sobre páginas guardadas en tests/fixtures.
+Comparan el tiempo de CPU por respuesta de los parsers actuales con el de las versiones anteriores, que
+volvían a recorrer el DOM por cada review o deal con una XPath indexada.
+
+Los tiempos se imprimen por la salida estándar, e.g:
+python -m pytest -s tests/test_hotel_spider_benchmark.py
+'''
+
+import unittest
+from time import process_time
+from datetime import datetime
+from hashlib import sha256
+from os.path import dirname, join
+
+try:
+    from scrapy.http import HtmlResponse, Request
+    from TripAdvisorScraper.spiders.tripadvisor_hotel_spider import TripAdvisorHotelSpider
+    from TripAdvisorScraper.item_loader import ItemLoader
+    from TripAdvisorScraper.items import TripAdvisorHotelReview, TripAdvisorHotelDeals
+except ImportError:
+    TripAdvisorHotelSpider = None
+
+
+# Url de la página del hotel de las fixtures
+HOTEL_URL = 'https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html'
+
+# Número de veces que se procesa cada página
+NUM_ITERATIONS = 200
+
+
+def read_fixture(file_name):
+    with open(join(dirname(__file__), 'fixtures', file_name), 'rb') as fh:
+        return fh.read()
+
+
+def get_cpu_time(parser, body, meta = None, num_iterations = NUM_ITERATIONS):
+    '''
+    Devuelve el tiempo de CPU medio (en segundos) que tarda un parser en procesar una página, incluyendo
+    el parseo del HTML (se construye una respuesta nueva en cada iteración)
+    :param parser: Es una función que recibe la respuesta y devuelve un listado con los resultados.
+    :param body: Es el contenido de la página.
+    :param meta: Son los metadatos de la request.
+    :return:
+    '''
+    start = process_time()
+    for _ in range(num_iterations):
+        response = HtmlResponse(url = HOTEL_URL, body = body, encoding = 'utf-8', request = Request(HOTEL_URL, meta = dict(meta or {})))
+        parser(response)
+    return (process_time() - start) / num_iterations
+
+
+def report(name, before, after):
+    print('\n{}: {:.3f} ms -> {:.3f} ms per response ({:.2f}x)'.format(name, before * 1000, after * 1000, before / after))
+
+
+def legacy_parse_hotel_reviews(response, hotel_id):
+    '''
+    Extracción de reviews anterior: Una XPath indexada sobre todo el listado por cada review.
+    '''
+    num_reviews = len(response.css('div.listContainer div.review-container').extract())
+    for i in range(0, num_reviews):
+        try:
+            review_selector = response.css('div.listContainer')
+            review_selector = review_selector.xpath('.//div[contains(@class, "review-container")][{}]'.format(i + 1))
+
+            loader = ItemLoader(item = TripAdvisorHotelReview(), selector = review_selector)
+            loader.add_css('title', 'span.noQuotes::text')
+            loader.add_css('text', 'div.prw_reviews_text_summary_hsx p.partial_entry::text')
+            loader.add_css('rating', 'span.ui_bubble_rating', re = r'class="[^"]*bubble_(\d+)[^"]*"')
+            loader.add_value('hotel_id', hotel_id)
+
+            date = review_selector.css('span.ratingDate::attr(title)').extract_first()
+            month_str, day, year = TripAdvisorHotelSpider.review_date_regex.match(date).groups()
+            month = TripAdvisorHotelSpider.months[month_str.lower()]
+            loader.add_value('date', datetime(year = int(year), month = month, day = int(day)).date().isoformat())
+
+            yield loader.load_item()
+        except Exception:
+            pass
+
+
+def legacy_parse_hotel_deals(response):
+    '''
+    Extracción de deals anterior: La id del hotel se calculaba de nuevo y se ejecutaba una XPath indexada
+    sobre todas las ofertas por cada deal.
+    '''
+    hasher = sha256()
+    hasher.update(response.url.encode())
+    hotel_id = hasher.hexdigest()
+
+    num_deals = len(response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links').xpath(
+        './/div[contains(@class, "offer") and contains(@class, "textLink") and not(contains(@class, "unclickable"))]'))
+    for i in range(0, num_deals):
+        try:
+            deal_selector = response.css('div.premium_offers_area.viewDealChevrons div.prw_meta_view_all_text_links')
+            deal_selector = deal_selector.xpath(
+                './/div[contains(@class, "offer") and contains(@class, "textLink") and not(contains(@class, "unclickable"))][{}]'.format(i + 1))
+
+            loader = ItemLoader(item = TripAdvisorHotelDeals(), selector = deal_selector)
+            loader.add_css('provider_name', 'span.providerName::attr(title)')
+            loader.add_css('price', 'span.price::attr(title)', re = r'(\d+)')
+            loader.add_value('hotel_id', hotel_id)
+            yield loader.load_item()
+        except Exception:
+            pass
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorHotelReviewsBenchmark(unittest.TestCase):
+    '''
+    Tiempo de CPU por página de reviews (10 reviews)
+    '''
+    def setUp(self):
+        self.spider = TripAdvisorHotelSpider(SEARCH_BY_TERMS = 'Hotel Blanca Navarra')
+        self.body = read_fixture('hotel_reviews_page.html')
+        # Página de reviews ya paginada: solo se mide la extracción de las reviews.
+        self.meta = {'hotel_id': 'g187520-d233664', 'review_offset': 10, 'review_fan_out': True,
+                     'review_url_template': HOTEL_URL.replace('-Reviews-', '-Reviews-or{offset}-')}
+
+    def parse(self, response):
+        return list(self.spider.parse_hotel_reviews(response))
+
+    def legacy_parse(self, response):
+        return list(legacy_parse_hotel_reviews(response, response.meta['hotel_id']))
+
+    def test_reviews_page(self):
+        response = HtmlResponse(url = HOTEL_URL, body = self.body, encoding = 'utf-8', request = Request(HOTEL_URL, meta = self.meta))
+        items = self.parse(response)
+        self.assertEqual(len(items), 10)
+        self.assertEqual([item['title'] for item in items], [item['title'] for item in self.legacy_parse(response)])
+
+        before = get_cpu_time(self.legacy_parse, self.body, self.meta)
+        after = get_cpu_time(self.parse, self.body, self.meta)
+        report('Reviews page', before, after)
+
+
+
+@unittest.skipIf(TripAdvisorHotelSpider is None, 'scrapy is not installed')
+class TripAdvisorHotelDealsBenchmark(unittest.TestCase):
+    '''
+    Tiempo de CPU por página de deals (12 ofertas, 2 de ellas no clickables)
+    '''
+    def setUp(self):
+        self.spider = TripAdvisorHotelSpider(SEARCH_BY_TERMS = 'Hotel Blanca Navarra')
+        self.body = read_fixture('hotel_deals_page.html')
+        self.meta = {'hotel_id': 'g187520-d233664'}
+
+    def parse(self, response):
+        return list(self.spider.parse_hotel_deals(response))
+
+    def test_deals_page(self):
+        response = HtmlResponse(url = HOTEL_URL, body = self.body, encoding = 'utf-8', request = Request(HOTEL_URL, meta = self.meta))
+        items = self.parse(response)
+        self.assertEqual(len(items), 10)
+        self.assertEqual([(item['provider_name'], item['price']) for item in items],
+                         [(item['provider_name'], item['price']) for item in legacy_parse_hotel_deals(response)])
+
+        before = get_cpu_time(lambda response: list(legacy_parse_hotel_deals(response)), self.body, self.meta)
+        after = get_cpu_time(self.parse, self.body, self.meta)
+        report('Deals page', before, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
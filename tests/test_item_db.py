@@ -0,0 +1,104 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de la base de datos sqlite donde se almacenan los items (TripAdvisorScraper.item_db)
+'''
+
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+from TripAdvisorScraper.item_db import TripAdvisorDB, migrations
+
+
+class TripAdvisorDBQueryPlanTest(unittest.TestCase):
+    '''
+    Comprueba que las consultas por hotel usan los índices del esquema (y no recorren las tablas enteras)
+    '''
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.db = TripAdvisorDB(join(self.tmp_dir.name, 'tripadvisor.db'))
+        self.db.migrate()
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def get_query_plan(self, query, params = ()):
+        return ' '.join(register[-1] for register in self.db.db.execute('EXPLAIN QUERY PLAN ' + query, params))
+
+    def test_schema_is_migrated(self):
+        self.assertEqual(self.db.get_schema_version(), len(migrations))
+
+    def test_deals_by_hotel_use_covering_index(self):
+        plan = self.get_query_plan('SELECT hotel_id, provider_name, price FROM hotel_deal ORDER BY hotel_id, deal_id;')
+        self.assertIn('COVERING INDEX hotel_deal_by_hotel', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_reviews_by_hotel_use_index(self):
+        plan = self.get_query_plan('SELECT hotel_id, title, rating, text, date FROM hotel_review ORDER BY hotel_id, review_id;')
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_review_lookups_use_covering_index(self):
+        plan = self.get_query_plan('SELECT 1 FROM hotel_review WHERE tripadvisor_id = ?;', (1,))
+        self.assertIn('COVERING INDEX hotel_review_by_tripadvisor_id', plan)
+
+        plan = self.get_query_plan('SELECT 1 FROM hotel_review WHERE hotel_id = ? AND date = ? AND title = ? LIMIT 1;',
+                                   ('g1-d2', '2017-10-18', 'title'))
+        self.assertIn('COVERING INDEX hotel_review_by_hotel_date', plan)
+
+    def test_hotel_lookups_use_index(self):
+        plan = self.get_query_plan('SELECT 1 FROM hotel_info WHERE id = ?;', ('g1-d2',))
+        self.assertIn('SEARCH hotel_info USING COVERING INDEX', plan)
+
+        plan = self.get_query_plan('SELECT scraped_at FROM hotel_info WHERE id = ?;', ('g1-d2',))
+        self.assertIn('SEARCH hotel_info USING INDEX', plan)
+
+        plan = self.get_query_plan(
+            '''
+            SELECT hotel_info.id, name, latitude, longitude
+            FROM hotel_info LEFT JOIN hotel_geo ON hotel_geo.hotel_id = hotel_info.id
+            ORDER BY hotel_info.id;
+            ''')
+        self.assertIn('SEARCH hotel_geo USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class TripAdvisorDBMigrationTest(unittest.TestCase):
+    '''
+    Comprueba que las migraciones solo se aplican desde el proceso que escribe en la base de datos
+    '''
+    def test_connections_do_not_migrate(self):
+        with TemporaryDirectory() as tmp_dir:
+            db_path = join(tmp_dir, 'tripadvisor.db')
+            with TripAdvisorDB(db_path) as db:
+                self.assertEqual(db.get_schema_version(), 0)
+                db.migrate()
+
+            with TripAdvisorDB(db_path, read_only = True) as db:
+                self.assertEqual(db.get_schema_version(), len(migrations))
+                self.assertEqual(list(db.iter_everything()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de los downloader middlewares (TripAdvisorScraper.middlewares)
+'''
+
+import unittest
+import logging
+
+try:
+    from scrapy.http import Request, Response
+    from scrapy.exceptions import IgnoreRequest
+    from TripAdvisorScraper.middlewares import SplashBackendPool, SplashPoolMiddleware, GeocodeLane, GeocodeLaneDownloaderMiddleware
+except ImportError:
+    SplashBackendPool = None
+
+
+class FakeClock:
+    '''
+    Reloj cuyo tiempo se avanza manualmente.
+    '''
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSpider:
+    logger = logging.getLogger('FakeSpider')
+
+
+class FakeStats:
+    def inc_value(self, key, value = 1):
+        pass
+
+    def max_value(self, key, value):
+        pass
+
+
+class FakeSignals:
+    def connect(self, receiver, signal):
+        pass
+
+
+class FakeEngine:
+    def __init__(self):
+        self.requests = []
+
+    def crawl(self, request, spider):
+        self.requests.append(request)
+
+
+class FakeCrawler:
+    '''
+    Crawler con lo mínimo que necesita el carril de geolocalización. Las requests que se envían al motor
+    se guardan en engine.requests
+    '''
+    def __init__(self):
+        self.stats = FakeStats()
+        self.signals = FakeSignals()
+        self.engine = FakeEngine()
+
+
+@unittest.skipIf(SplashBackendPool is None, 'scrapy is not installed')
+class SplashBackendPoolTest(unittest.TestCase):
+    '''
+    Comprueba el reparto de requests entre las instancias de Splash y la expulsión de las que fallan
+    '''
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = SplashBackendPool(['http://splash1:8050', 'http://splash2:8050/'],
+                                      max_consecutive_errors = 2, eject_time = 30, clock = self.clock)
+        self.splash1, self.splash2 = self.pool.backends
+
+    def test_least_outstanding_backend_is_selected(self):
+        self.assertEqual(self.splash1.url, 'http://splash1:8050/')
+        self.assertIs(self.pool.acquire(), self.splash1)
+        self.assertIs(self.pool.acquire(), self.splash2)
+        self.pool.release(self.splash1, latency = 2)
+        self.pool.release(self.splash2, latency = 1)
+
+        # A igualdad de requests pendientes, se selecciona la instancia con menor latencia.
+        self.assertIs(self.pool.acquire(), self.splash2)
+        self.assertEqual((self.splash1.outstanding, self.splash2.outstanding), (0, 1))
+
+    def test_failover_and_eject(self):
+        for _ in range(2):
+            self.pool.release(self.pool.acquire(exclude = [self.splash2.url]), error = True)
+        self.assertFalse(self.splash1.is_healthy(self.clock()))
+
+        # La instancia expulsada no se selecciona aunque tenga menos requests pendientes.
+        self.pool.acquire()
+        self.assertIs(self.pool.acquire(), self.splash2)
+        self.assertIs(self.pool.acquire(exclude = [self.splash2.url]), self.splash1)
+
+        # Pasado el tiempo de expulsión, la instancia vuelve al pool.
+        self.clock.now = 31
+        self.assertTrue(self.splash1.is_healthy(self.clock()))
+        self.assertIs(self.pool.acquire(), self.splash1)
+
+    def test_all_backends_ejected(self):
+        for backend in self.pool.backends:
+            for _ in range(2):
+                self.pool.acquire()
+                self.pool.release(backend, error = True)
+        self.assertIn(self.pool.acquire(), self.pool.backends)
+
+    def test_cancel(self):
+        backend = self.pool.acquire()
+        self.pool.cancel(backend)
+        self.assertEqual((backend.outstanding, backend.num_requests, backend.latency), (0, 0, None))
+
+
+@unittest.skipIf(SplashBackendPool is None, 'scrapy is not installed')
+class SplashPoolMiddlewareTest(unittest.TestCase):
+    '''
+    Comprueba el reintento de las requests en otra instancia y que las respuestas de la caché de páginas
+    no cuentan para la latencia ni para los errores de las instancias.
+    '''
+    def setUp(self):
+        self.pool = SplashBackendPool(['http://splash1:8050/', 'http://splash2:8050/'], max_consecutive_errors = 1)
+        self.middleware = SplashPoolMiddleware(self.pool, max_retries = 1)
+        self.spider = FakeSpider()
+
+    def get_request(self):
+        # Simula el procesamiento de la request por SplashMiddleware
+        request = Request('https://www.tripadvisor.com/', meta = {'splash': {'args': {}}})
+        self.middleware.process_request(request, self.spider)
+        request = request.replace(url = request.meta['splash']['splash_url'] + 'execute')
+        request.meta['_splash_processed'] = True
+        self.middleware.process_request(request, self.spider)
+        return request
+
+    def test_cached_response(self):
+        request = self.get_request()
+        backend = self.pool.get_backend(request.meta['splash_backend'])
+        response = Response(request.url, status = 503, flags = ['cached'], request = request)
+
+        self.assertIs(self.middleware.process_response(request, response, self.spider), response)
+        self.assertEqual((backend.outstanding, backend.num_requests, backend.num_errors, backend.latency), (0, 0, 0, None))
+
+    def test_retry_on_other_backend(self):
+        request = self.get_request()
+        backend = self.pool.get_backend(request.meta['splash_backend'])
+        response = Response(request.url, status = 503, request = request)
+
+        retry_request = self.middleware.process_response(request, response, self.spider)
+        self.assertIsInstance(retry_request, Request)
+        self.assertNotEqual(retry_request.meta['splash_backend'], backend.url)
+        self.assertEqual(retry_request.url, retry_request.meta['splash_backend'] + 'execute')
+        self.assertEqual(backend.num_errors, 1)
+        self.assertFalse(backend.is_healthy(self.pool.clock()))
+
+
+
+@unittest.skipIf(SplashBackendPool is None, 'scrapy is not installed')
+class GeocodeLaneTest(unittest.TestCase):
+    '''
+    Comprueba el límite de velocidad del carril de geolocalización y que las requests se liberan
+    en todos los casos.
+    '''
+    def setUp(self):
+        self.crawler = FakeCrawler()
+        self.spider = FakeSpider()
+
+    def get_request(self, index = 0):
+        return Request('https://maps.googleapis.com/maps/api/geocode/json?address={}'.format(index),
+                       meta = {'geocode_lane': True})
+
+    def test_rate_limit(self):
+        lane = GeocodeLane(self.crawler, rate = 1, burst = 2, max_in_flight = 10, clock = FakeClock())
+        for index in range(2):
+            lane.enqueue(self.get_request(index), self.spider)
+        self.assertEqual(len(self.crawler.engine.requests), 2)
+        self.assertEqual(lane.in_flight, 2)
+
+    def test_no_rate_limit(self):
+        # Con límite de velocidad 0 solo se limita el número de requests simultáneas.
+        lane = GeocodeLane(self.crawler, rate = 0, burst = 0, max_in_flight = 3, clock = FakeClock())
+        for index in range(5):
+            lane.enqueue(self.get_request(index), self.spider)
+        self.assertEqual(len(self.crawler.engine.requests), 3)
+        self.assertEqual(len(lane.queue), 2)
+
+        middleware = GeocodeLaneDownloaderMiddleware(lane)
+        request = self.crawler.engine.requests[0]
+        response = Response(request.url, status = 200, body = b'{"status": "OK", "results": []}', request = request)
+        middleware.process_response(request, response, self.spider)
+        self.assertEqual(len(self.crawler.engine.requests), 4)
+        self.assertEqual(lane.in_flight, 3)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            GeocodeLane(self.crawler, rate = 1, burst = 0)
+        with self.assertRaises(ValueError):
+            GeocodeLane(self.crawler, max_in_flight = 0)
+
+    def test_ignored_request_is_released(self):
+        lane = GeocodeLane(self.crawler, rate = 0, max_in_flight = 1, clock = FakeClock())
+        middleware = GeocodeLaneDownloaderMiddleware(lane)
+        lane.enqueue(self.get_request(0), self.spider)
+        lane.enqueue(self.get_request(1), self.spider)
+        self.assertEqual(lane.in_flight, 1)
+
+        # La request la descarta otro middleware: se libera (una única vez) y no se reintenta.
+        request = self.crawler.engine.requests[0]
+        self.assertIsNone(middleware.process_exception(request, IgnoreRequest(), self.spider))
+        self.assertIsNone(middleware.process_exception(request, IgnoreRequest(), self.spider))
+        self.assertEqual(len(self.crawler.engine.requests), 2)
+        self.assertEqual(lane.in_flight, 1)
+        self.assertFalse(request.meta.get('geocode_lane_retried', False))
+
+        middleware.process_exception(self.crawler.engine.requests[1], IgnoreRequest(), self.spider)
+        self.assertTrue(lane.is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
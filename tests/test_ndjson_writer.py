@@ -0,0 +1,100 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de la escritura de los ficheros NDJSON (TripAdvisorScraper.ndjson_writer)
+'''
+
+import unittest
+import gzip
+import json
+from os.path import join, exists, getsize
+from tempfile import TemporaryDirectory
+from TripAdvisorScraper.ndjson_writer import NDJSONWriter
+
+
+class NDJSONWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.file_path = join(self.tmp_dir.name, 'reviews.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_lines(self, file_path):
+        with open(file_path, 'rb') as fh:
+            return [json.loads(line.decode('utf-8')) for line in fh]
+
+    def write_parts(self, append, num_items):
+        writer = NDJSONWriter(self.file_path, max_size = 20, append = append)
+        for index in range(num_items):
+            writer.write({'index': index})
+        writer.close()
+        return writer
+
+    def test_rotation(self):
+        self.write_parts(append = False, num_items = 5)
+        # Cada objeto ocupa más de 10 bytes: se rota después de cada dos objetos.
+        self.assertEqual(self.read_lines(self.file_path), [{'index': 0}, {'index': 1}])
+        self.assertEqual(self.read_lines(join(self.tmp_dir.name, 'reviews.2.json')), [{'index': 4}])
+
+    def test_write_removes_previous_parts(self):
+        self.write_parts(append = False, num_items = 5)
+        self.write_parts(append = False, num_items = 1)
+        self.assertEqual(self.read_lines(self.file_path), [{'index': 0}])
+        self.assertFalse(exists(join(self.tmp_dir.name, 'reviews.1.json')))
+        self.assertFalse(exists(join(self.tmp_dir.name, 'reviews.2.json')))
+
+    def test_append_continues_last_part(self):
+        self.write_parts(append = False, num_items = 5)
+        writer = self.write_parts(append = True, num_items = 3)
+
+        # Se continúa en el último fichero, teniendo en cuenta lo que ya tenía para rotarlo.
+        self.assertEqual(self.read_lines(join(self.tmp_dir.name, 'reviews.2.json')), [{'index': 4}, {'index': 0}])
+        self.assertEqual(self.read_lines(join(self.tmp_dir.name, 'reviews.3.json')), [{'index': 1}, {'index': 2}])
+        self.assertEqual(self.read_lines(self.file_path), [{'index': 0}, {'index': 1}])
+        self.assertEqual(writer.file_index, 3)
+
+    def test_idle_flush(self):
+        writer = NDJSONWriter(self.file_path, flush_interval = 60)
+        writer.write({'index': 0})
+        self.assertEqual(getsize(self.file_path), 0)
+
+        writer.flush_if_needed()
+        self.assertEqual(getsize(self.file_path), 0)
+
+        # Pasado el intervalo, se vuelca el buffer aunque no se escriban más objetos.
+        writer.last_flush -= 60
+        writer.flush_if_needed()
+        self.assertEqual(self.read_lines(self.file_path), [{'index': 0}])
+        writer.close()
+
+    def test_compressed_flush(self):
+        writer = NDJSONWriter(self.file_path, flush_interval = 0, compress = True)
+        writer.write({'index': 0})
+        with gzip.open(self.file_path + '.gz', 'rb') as fh:
+            self.assertEqual(json.loads(fh.readline().decode('utf-8')), {'index': 0})
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de la caché de páginas (TripAdvisorScraper.render_cache)
+'''
+
+import unittest
+import sqlite3
+import logging
+from os.path import join
+from tempfile import TemporaryDirectory
+
+try:
+    from scrapy.settings import Settings
+    from scrapy.http import HtmlResponse, Request
+    from TripAdvisorScraper.render_cache import SQLiteRenderCacheStorage, RENDER_FAILED_HEADER
+except ImportError:
+    SQLiteRenderCacheStorage = None
+
+
+class FakeSpider:
+    name = 'TripAdvisorHotelSpider'
+    logger = logging.getLogger('FakeSpider')
+
+
+@unittest.skipIf(SQLiteRenderCacheStorage is None, 'scrapy is not installed')
+class SQLiteRenderCacheStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.spider = FakeSpider()
+        self.storage = SQLiteRenderCacheStorage(Settings({
+            'HTTPCACHE_DIR': self.tmp_dir.name,
+            'RENDER_CACHE_TTL': {'hotel': 3600},
+            'RENDER_CACHE_COMMIT_SIZE': 2,
+            'RENDER_CACHE_COMMIT_INTERVAL': 3600
+        }))
+        self.storage.open_spider(self.spider)
+
+    def tearDown(self):
+        self.storage.close_spider(self.spider)
+        self.tmp_dir.cleanup()
+
+    def get_request(self, url):
+        return Request(url, meta = {'render_cache_type': 'hotel'})
+
+    def get_response(self, request, headers = None):
+        return HtmlResponse(request.url, body = b'<html><body>Hotel</body></html>', headers = headers, request = request)
+
+    def count_committed_pages(self):
+        db = sqlite3.connect(join(self.tmp_dir.name, '{}.render_cache.db'.format(self.spider.name)))
+        try:
+            return db.execute('SELECT COUNT(*) FROM render_cache;').fetchone()[0]
+        finally:
+            db.close()
+
+    def test_store_and_retrieve(self):
+        request = self.get_request('https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews.html')
+        self.storage.store_response(self.spider, request, self.get_response(request))
+        response = self.storage.retrieve_response(self.spider, request)
+        self.assertEqual(response.body, b'<html><body>Hotel</body></html>')
+
+    def test_failed_renders_are_not_stored(self):
+        request = self.get_request('https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews.html')
+        self.storage.store_response(self.spider, request, self.get_response(request, {RENDER_FAILED_HEADER: '1'}))
+        self.assertIsNone(self.storage.retrieve_response(self.spider, request))
+
+    def test_commits_are_batched(self):
+        for index in range(3):
+            request = self.get_request('https://www.tripadvisor.com/Hotel_Review-g187520-d{}-Reviews.html'.format(index))
+            self.storage.store_response(self.spider, request, self.get_response(request))
+            # Los cambios se confirman cada 2 páginas.
+            self.assertEqual(self.count_committed_pages(), 2 if index > 0 else 0)
+
+        self.storage.close_spider(self.spider)
+        self.assertEqual(self.count_committed_pages(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
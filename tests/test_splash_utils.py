@@ -0,0 +1,117 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Tests de la generación de los scripts de Splash (TripAdvisorScraper.spiders.splash_utils) y de
+las acciones de las requests a TripAdvisor (TripAdvisorScraper.spiders.requests)
+'''
+
+import unittest
+
+try:
+    from TripAdvisorScraper.spiders.splash_utils import compile_lua_script, _compile_lua_script, get_splash_cache_args, ElementReady, Wait, DebugMessage, LuaSplashScript
+    from TripAdvisorScraper.spiders.requests import get_hotel_deals_actions, get_search_results_page_actions
+except ImportError:
+    compile_lua_script = None
+from TripAdvisorScraper.config.config import GlobalConfig
+
+
+@unittest.skipIf(compile_lua_script is None, 'scrapy_splash is not installed')
+class LuaScriptCacheTest(unittest.TestCase):
+    '''
+    Comprueba que los scripts en LUA y las acciones de las requests se generan una única vez.
+    '''
+    def setUp(self):
+        _compile_lua_script.cache_clear()
+
+    def test_script_is_compiled_once(self):
+        script = compile_lua_script(ElementReady('#some-element', 5) + Wait(1), debug = False, timeout = 30)
+        info = _compile_lua_script.cache_info()
+        self.assertEqual((info.hits, info.misses), (0, 1))
+
+        # Las mismas acciones (aunque sean otros objetos) reutilizan el script generado.
+        self.assertIs(compile_lua_script(ElementReady('#some-element', 5) + Wait(1), debug = False, timeout = 30), script)
+        info = _compile_lua_script.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_script_depends_on_actions_and_profile(self):
+        script = compile_lua_script(Wait(1), debug = False, timeout = 30)
+        self.assertNotEqual(compile_lua_script(Wait(2), debug = False, timeout = 30), script)
+        self.assertNotEqual(compile_lua_script(Wait(1), debug = True, timeout = 30), script)
+        self.assertNotEqual(compile_lua_script(Wait(1), debug = False, timeout = 10), script)
+        self.assertEqual(_compile_lua_script.cache_info().misses, 4)
+
+    def test_failed_actions_are_flagged(self):
+        for timeout in [None, 30]:
+            script = compile_lua_script(Wait(1), debug = False, timeout = timeout)
+            self.assertIn('local actions_ok = ', script)
+            self.assertIn('splash:set_result_header("X-Render-Failed", "1")', script)
+
+    def test_script_is_stored_in_actions(self):
+        actions = get_hotel_deals_actions(10)
+        script = compile_lua_script(actions, debug = False, timeout = 30)
+        info = _compile_lua_script.cache_info()
+
+        # Con el mismo objeto de acciones, el script se toma del propio objeto (no se consulta la caché)
+        self.assertIs(compile_lua_script(actions, debug = False, timeout = 30), script)
+        self.assertEqual(_compile_lua_script.cache_info(), info)
+        self.assertNotEqual(compile_lua_script(actions, debug = True, timeout = 30), script)
+
+    def test_debug_messages_follow_profile(self):
+        # Los mensajes de depuración dependen del perfil del script, no de "ENABLE_DEBUG"
+        actions = DebugMessage('Hello World!')
+        self.assertIn('local debug_enabled = true', str(LuaSplashScript(actions, debug = True)))
+        self.assertIn('local debug_enabled = false', str(LuaSplashScript(actions, debug = False)))
+        self.assertIn('if debug_enabled then', str(actions))
+
+    def test_actions_are_built_once(self):
+        self.assertIs(get_hotel_deals_actions(10), get_hotel_deals_actions(10))
+        self.assertIsNot(get_hotel_deals_actions(10), get_hotel_deals_actions(5))
+        self.assertIs(get_search_results_page_actions(3, 10), get_search_results_page_actions(3, 10))
+        self.assertNotEqual(str(get_search_results_page_actions(3, 10)), str(get_search_results_page_actions(4, 10)))
+
+
+@unittest.skipIf(compile_lua_script is None, 'scrapy_splash is not installed')
+class SplashCacheArgsTest(unittest.TestCase):
+    '''
+    Comprueba que los argumentos de Splash solo se cachean si hay una única instancia de Splash
+    '''
+    def setUp(self):
+        config = GlobalConfig()
+        self.splash_urls = config.get_value('SPLASH_URLS') if config.is_set('SPLASH_URLS') else None
+
+    def tearDown(self):
+        GlobalConfig().set_value('SPLASH_URLS', self.splash_urls)
+
+    def test_single_instance(self):
+        GlobalConfig().set_value('SPLASH_URLS', ['http://localhost:8050/'])
+        self.assertEqual(get_splash_cache_args(), ['lua_source', 'scrap_utils', 'jquery'])
+
+    def test_pool(self):
+        GlobalConfig().set_value('SPLASH_URLS', ['http://splash1:8050/', 'http://splash2:8050/'])
+        self.assertEqual(get_splash_cache_args(), [])
+        GlobalConfig().set_value('SPLASH_URLS', 'http://splash1:8050/,http://splash2:8050/')
+        self.assertEqual(get_splash_cache_args(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+Copyright (c) 2017 Víctor Ruiz Gómez
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Benchmark de la construcción de las requests de Splash (TripAdvisorScraper.spiders.splash_utils).
+Compara el número de requests por segundo que se construyen ahora (acciones, scripts en LUA y ficheros
+JS memorizados) con el de la versión anterior, que volvía a generar las acciones y el script en LUA y a
+leer los ficheros JS del disco en cada request.
+
+Los resultados se imprimen por la salida estándar, e.g:
+python -m pytest -s tests/test_splash_utils_benchmark.py
+'''
+
+import unittest
+from time import process_time
+from os.path import dirname, join
+
+try:
+    from scrapy_splash import SplashRequest
+    from TripAdvisorScraper.spiders import splash_utils
+    from TripAdvisorScraper.spiders.splash_utils import LuaSplashScript, ElementsReady
+    from TripAdvisorScraper.spiders.requests import TripAdvisorRequests
+except ImportError:
+    SplashRequest = None
+
+
+# Url de la página del hotel
+HOTEL_URL = 'https://www.tripadvisor.com/Hotel_Review-g187520-d233664-Reviews-Hotel_Blanca_de_Navarra-Pamplona_Navarra.html'
+
+# Número de requests que se construyen en cada medida
+NUM_REQUESTS = 500
+
+
+def get_requests_per_second(build_request, num_requests = NUM_REQUESTS):
+    '''
+    Devuelve el número de requests construidas por segundo de CPU.
+    :param build_request: Es una función que construye una request.
+    '''
+    start = process_time()
+    for _ in range(num_requests):
+        build_request()
+    return num_requests / max(process_time() - start, 1e-9)
+
+
+def legacy_get_hotel_page(url, callback):
+    '''
+    Construcción anterior de la request de la página de un hotel con sus deals.
+    '''
+    def read_js_script(path):
+        with open(join(dirname(splash_utils.__file__), '..', 'static', 'js', path)) as fh:
+            return fh.read()
+
+    actions = ElementsReady(['div.premium_offers_area.viewDealChevrons'])
+    code = LuaSplashScript(actions)
+    return SplashRequest(callback = callback,
+                         endpoint = 'execute',
+                         args = {
+                             'lua_source': str(code),
+                             'url': url,
+                             'scrap_utils': read_js_script('scrap_utils.js'),
+                             'jquery': read_js_script('jquery.min.js')
+                         })
+
+
+def callback(response):
+    pass
+
+
+@unittest.skipIf(SplashRequest is None, 'scrapy_splash is not installed')
+class SplashRequestBenchmark(unittest.TestCase):
+    def test_hotel_page_requests(self):
+        before = get_requests_per_second(lambda: legacy_get_hotel_page(HOTEL_URL, callback))
+        after = get_requests_per_second(lambda: TripAdvisorRequests.get_hotel_page(url = HOTEL_URL, callback = callback,
+                                                                                  fetch_deals = True))
+        print('\nSplash hotel page requests: {:.0f} -> {:.0f} requests per second ({:.2f}x)'.format(before, after, after / before))
+
+        # Las requests que se construyen ahora siguen ejecutando las mismas acciones.
+        request = TripAdvisorRequests.get_hotel_page(url = HOTEL_URL, callback = callback, fetch_deals = True)
+        self.assertIn('div.premium_offers_area.viewDealChevrons', request.meta['splash']['args']['lua_source'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,8 +24,10 @@ SOFTWARE.
 Este script ejecuta el cliente web del scraper de TripAdvisor usando el framework Flask
 '''
 
-from flask import Flask, render_template, request, redirect, make_response
+from flask import Flask, render_template, request, redirect, make_response, Response, stream_with_context
 from os.path import dirname, join, abspath
+from urllib.request import pathname2url
+from tempfile import TemporaryDirectory
 import json
 import sqlite3 as sqlite
 from web.scraper import TripAdvisorScraper
@@ -199,13 +201,21 @@ def get_json():
     Sobre la ruta "/get-json-data" se obtienen los datos escrapeados en formato JSON
     :return:
     '''
-    try:
-        with TripAdvisorDB(db_path = GlobalConfig().get_path('OUTPUT_SQLITE')) as db:
-            data = db.get_everything()
-    except:
-        data = []
-
-    response = make_response(json.dumps(data))
+    def generate():
+        # Los datos se envían a medida que se leen de la base de datos. Si no se pueden leer, se
+        # envía una lista vacía.
+        started = False
+        try:
+            with TripAdvisorDB(db_path = GlobalConfig().get_path('OUTPUT_SQLITE'), read_only = True) as db:
+                for chunk in db.iter_everything_json():
+                    started = True
+                    yield chunk
+        except:
+            if started:
+                raise
+            yield '[]'
+
+    response = Response(stream_with_context(generate()), mimetype = 'application/json')
     response.headers['Content-Disposition'] = 'attachment; filename=tripadvisor.json'
     return response
 
@@ -217,9 +227,21 @@ def get_sqlite():
     datos escrapeados hasta el momento
     :return:
     '''
+    # La base de datos está en modo WAL: los últimos cambios pueden estar todavía en el fichero "-wal".
+    # Se copia la base de datos (incluyendo esos cambios) a un fichero temporal usando la API de backup
+    # de sqlite, y se envía la copia.
     try:
-        with open(GlobalConfig().get_path('OUTPUT_SQLITE'), 'rb') as fh:
-            data = fh.read()
+        db_path = abspath(GlobalConfig().get_path('OUTPUT_SQLITE'))
+        with TemporaryDirectory() as tmp_dir:
+            source = sqlite.connect('file:{}?mode=ro'.format(pathname2url(db_path)), uri = True)
+            target = sqlite.connect(join(tmp_dir, 'tripadvisor.db'))
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            with open(join(tmp_dir, 'tripadvisor.db'), 'rb') as fh:
+                data = fh.read()
     except:
         return 'Error fetching sqlite file database'
 